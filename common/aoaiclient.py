@@ -0,0 +1,150 @@
+import asyncio
+import hashlib
+import importlib.util
+import logging
+import os
+import threading
+import weakref
+from typing import Dict, Optional, Tuple
+
+import httpx
+from openai import AsyncAzureOpenAI, AzureOpenAI
+
+log = logging.getLogger(__name__)
+
+
+class OpenAIClientManager:
+    """
+    Azure OpenAI 客户端管理器，每个 (endpoint, deployment, api_version, api_key) 只保留一个长期存活的客户端，
+    复用同一个 httpx 连接池，避免每次请求都重新建立 TLS 连接。
+
+    httpx.AsyncClient 的连接绑定创建它的事件循环，异步客户端按事件循环分别缓存，
+    asyncio.run 包装的一次性调用不会复用已关闭循环上的客户端。
+
+    连接池参数由环境变量配置：OPENAI_MAX_CONNECTIONS、OPENAI_MAX_KEEPALIVE、
+    OPENAI_KEEPALIVE_EXPIRY、OPENAI_TIMEOUT、OPENAI_HTTP2（需要安装 h2）。
+    """
+
+    def __init__(self):
+        self._async_clients: Dict[Tuple, Tuple[AsyncAzureOpenAI, Optional[weakref.ref]]] = {}
+        self._sync_clients: Dict[Tuple, AzureOpenAI] = {}
+        self._lock = threading.Lock()
+
+    @staticmethod
+    def _transport_options() -> dict:
+        http2 = os.environ.get("OPENAI_HTTP2", "1") in ["1", "true"]
+        if http2 and importlib.util.find_spec("h2") is None:
+            log.warning("h2 is not installed, OpenAI clients fall back to HTTP/1.1")
+            http2 = False
+        return dict(
+            limits=httpx.Limits(
+                max_connections=int(os.environ.get("OPENAI_MAX_CONNECTIONS", 100)),
+                max_keepalive_connections=int(os.environ.get("OPENAI_MAX_KEEPALIVE", 20)),
+                keepalive_expiry=float(os.environ.get("OPENAI_KEEPALIVE_EXPIRY", 120)),
+            ),
+            timeout=httpx.Timeout(float(os.environ.get("OPENAI_TIMEOUT", 600)), connect=10.0),
+            http2=http2,
+        )
+
+    @staticmethod
+    def _key_digest(api_key: str) -> str:
+        return hashlib.sha256((api_key or "").encode()).hexdigest()[:16]
+
+    def get_async(
+        self,
+        endpoint: str,
+        api_key: str,
+        api_version: str,
+        deployment: str = None,
+        max_retries: int = None,
+    ) -> AsyncAzureOpenAI:
+        """
+        返回当前事件循环上共享的异步客户端。
+
+        Args:
+            endpoint (str): Azure OpenAI 终结点。
+            api_key (str): API 密钥。
+            api_version (str): API 版本。
+            deployment (str, optional): 部署名称。
+            max_retries (int, optional): SDK 自带的重试次数，为空时使用 SDK 默认值。
+
+        Returns:
+            AsyncAzureOpenAI: 共享的异步客户端。
+        """
+        try:
+            loop = asyncio.get_running_loop()
+        except RuntimeError:
+            loop = None
+        key = (
+            endpoint,
+            deployment,
+            api_version,
+            self._key_digest(api_key),
+            max_retries,
+            id(loop) if loop is not None else None,
+        )
+        with self._lock:
+            entry = self._async_clients.get(key)
+            # 循环被回收后 id 可能被新循环复用，弱引用失效说明是旧循环上的客户端
+            if entry is None or (entry[1] is not None and entry[1]() is not loop):
+                options = {"max_retries": max_retries} if max_retries is not None else {}
+                client = AsyncAzureOpenAI(
+                    azure_endpoint=endpoint,
+                    azure_deployment=deployment,
+                    api_key=api_key,
+                    api_version=api_version,
+                    http_client=httpx.AsyncClient(**self._transport_options()),
+                    **options,
+                )
+                entry = (client, weakref.ref(loop) if loop is not None else None)
+                for stale in [
+                    k for k, (_, ref) in self._async_clients.items() if ref is not None and ref() is None
+                ]:
+                    del self._async_clients[stale]
+                self._async_clients[key] = entry
+            return entry[0]
+
+    def get_sync(
+        self,
+        endpoint: str,
+        api_key: str,
+        api_version: str,
+        deployment: str = None,
+    ) -> AzureOpenAI:
+        """
+        返回共享的同步客户端，供脚本和进程池中的同步调用使用。
+        键中带有进程号，fork 出的子进程不会复用父进程的连接。
+        """
+        key = (endpoint, deployment, api_version, self._key_digest(api_key), os.getpid())
+        with self._lock:
+            client = self._sync_clients.get(key)
+            if client is None:
+                client = AzureOpenAI(
+                    azure_endpoint=endpoint,
+                    azure_deployment=deployment,
+                    api_key=api_key,
+                    api_version=api_version,
+                    http_client=httpx.Client(**self._transport_options()),
+                )
+                self._sync_clients[key] = client
+            return client
+
+    async def aclose(self):
+        """
+        关闭全部客户端及其连接池，在应用关闭时调用。
+        其他事件循环上的异步客户端无法在当前循环中关闭，只从缓存中移除。
+        """
+        loop = asyncio.get_running_loop()
+        with self._lock:
+            async_clients = list(self._async_clients.values())
+            sync_clients = list(self._sync_clients.values())
+            self._async_clients.clear()
+            self._sync_clients.clear()
+        for client, loop_ref in async_clients:
+            if loop_ref is None or loop_ref() is loop:
+                await client.close()
+        for client in sync_clients:
+            client.close()
+
+
+openai_clients = OpenAIClientManager()
@@ -0,0 +1,255 @@
+import asyncio
+import hashlib
+import logging
+import os
+import threading
+import time
+import unicodedata
+from array import array
+from collections import OrderedDict
+from typing import List, Optional
+
+import redis
+from langchain_core.embeddings import Embeddings
+
+
+log = logging.getLogger(__name__)
+
+
+def normalize_query(text: str) -> str:
+    """
+    归一化查询文本，使仅空白或全半角不同的查询命中同一缓存。
+
+    Args:
+        text (str): 原始查询文本。
+
+    Returns:
+        str: 归一化后的文本。
+    """
+    return " ".join(unicodedata.normalize("NFKC", text).split())
+
+
+class EmbeddingCache:
+    """
+    查询向量缓存：进程内 LRU + Redis 共享层（带 TTL）。
+
+    缓存键由嵌入模型和归一化查询文本的哈希组成，向量以 float32 字节存储。
+    键位于缓存命名空间 embeddings 中（cache:embeddings:{generation}:...），与 CacheNamespace
+    共用代号 cachegen:embeddings，失效只需递增代号，旧代的键由 CacheNamespace.purge 回收。
+    """
+
+    def __init__(
+        self,
+        url: Optional[str] = None,
+        maxsize: int = 4096,
+        expire: Optional[int] = 3600 * 24 * 7,
+        namespace: str = "embeddings",
+        generation_ttl: float = 1.0,
+    ):
+        """
+        :param url: Redis 连接 URL，为空时仅使用进程内 LRU
+        :param maxsize: 进程内 LRU 最大条目数
+        :param expire: Redis 层过期时间，单位为秒
+        :param namespace: 缓存命名空间名称
+        :param generation_ttl: 进程内缓存代号的时间，单位为秒
+        """
+        self.client = redis.Redis.from_url(url) if url else None
+        self.maxsize = maxsize
+        self.expire = expire
+        self.namespace = namespace
+        self.generation_key = f"cachegen:{namespace}"
+        self.generation_ttl = generation_ttl
+        self._generation = None
+        self._generation_at = 0.0
+        self._lru = OrderedDict()
+        self._lock = threading.Lock()
+        self.counters = {"lru_hits": 0, "redis_hits": 0, "misses": 0}
+
+    def generation(self, refresh: bool = False) -> int:
+        if self.client is None:
+            return 0
+        if (
+            refresh
+            or self._generation is None
+            or time.monotonic() - self._generation_at > self.generation_ttl
+        ):
+            try:
+                self._generation = int(self.client.get(self.generation_key) or 0)
+            except Exception as e:
+                log.error(f"Error getting cache generation: {e}")
+                self._generation = self._generation or 0
+            self._generation_at = time.monotonic()
+        return self._generation
+
+    def make_key(self, model: str, text: str, generation: int = None) -> str:
+        if generation is None:
+            generation = self.generation()
+        digest = hashlib.sha256(normalize_query(text).encode()).hexdigest()
+        return f"cache:{self.namespace}:{generation}:{model}:{digest}"
+
+    def _check_written(self, generation: int, keys: List[str]):
+        """写入后重新读取代号，写入期间缓存被失效时删除刚写入的旧代键。"""
+        if self.generation(refresh=True) != generation:
+            try:
+                self.client.unlink(*keys)
+            except Exception as e:
+                log.error(f"Error deleting embedding cache: {e}")
+
+    def _lru_get(self, key: str) -> Optional[List[float]]:
+        with self._lock:
+            vector = self._lru.get(key)
+            if vector is not None:
+                self._lru.move_to_end(key)
+            return vector
+
+    def _lru_set(self, key: str, vector: List[float]):
+        with self._lock:
+            self._lru[key] = vector
+            self._lru.move_to_end(key)
+            while len(self._lru) > self.maxsize:
+                self._lru.popitem(last=False)
+
+    def _count(self, name: str):
+        self._count_many(name, 1)
+
+    def _count_many(self, name: str, count: int):
+        with self._lock:
+            self.counters[name] += count
+
+    def get(self, model: str, text: str) -> Optional[List[float]]:
+        """
+        读取缓存向量，依次查询 LRU 和 Redis，Redis 命中时回填 LRU。
+        :return: 向量，未命中返回 None
+        """
+        key = self.make_key(model, text)
+        vector = self._lru_get(key)
+        if vector is not None:
+            self._count("lru_hits")
+            return vector
+        if self.client is not None:
+            try:
+                value = self.client.get(key)
+            except Exception as e:
+                log.error(f"Error getting embedding cache: {e}")
+                value = None
+            if value is not None:
+                vector = array("f", value).tolist()
+                self._lru_set(key, vector)
+                self._count("redis_hits")
+                return vector
+        self._count("misses")
+        return None
+
+    def get_many(self, model: str, texts: List[str]) -> List[Optional[List[float]]]:
+        """批量读取缓存向量，LRU 未命中的部分用一次 MGET 查询 Redis。"""
+        generation = self.generation()
+        keys = [self.make_key(model, text, generation) for text in texts]
+        vectors = [self._lru_get(key) for key in keys]
+        missing = [i for i, v in enumerate(vectors) if v is None]
+        self._count_many("lru_hits", len(keys) - len(missing))
+        if missing and self.client is not None:
+            try:
+                values = self.client.mget([keys[i] for i in missing])
+            except Exception as e:
+                log.error(f"Error getting embedding cache: {e}")
+                values = [None] * len(missing)
+            for i, value in zip(missing, values):
+                if value is not None:
+                    vectors[i] = array("f", value).tolist()
+                    self._lru_set(keys[i], vectors[i])
+                    self._count("redis_hits")
+        self._count_many("misses", sum(1 for v in vectors if v is None))
+        return vectors
+
+    def set_many(self, model: str, items: dict):
+        """批量写入缓存向量，Redis 层使用 pipeline。"""
+        generation = self.generation()
+        pipe = self.client.pipeline(transaction=False) if self.client is not None else None
+        keys = []
+        for text, vector in items.items():
+            key = self.make_key(model, text, generation)
+            keys.append(key)
+            self._lru_set(key, list(vector))
+            if pipe is not None:
+                pipe.set(key, array("f", vector).tobytes(), ex=self.expire)
+        if pipe is not None and keys:
+            try:
+                pipe.execute()
+                self._check_written(generation, keys)
+            except Exception as e:
+                log.error(f"Error setting embedding cache: {e}")
+
+    def set(self, model: str, text: str, vector: List[float]):
+        self.set_many(model, {text: vector})
+
+    def clear(self) -> int:
+        """
+        使全部缓存向量失效：清空进程内 LRU 并递增代号，O(1) 返回，旧代的键按 TTL 过期
+        或由 CacheNamespace.purge 回收。
+        :return: 新的代号
+        """
+        with self._lock:
+            self._lru.clear()
+        if self.client is None:
+            return 0
+        self._generation = self.client.incr(self.generation_key)
+        self._generation_at = time.monotonic()
+        return self._generation
+
+    def stats(self) -> dict:
+        with self._lock:
+            data = dict(self.counters)
+            data["lru_size"] = len(self._lru)
+        total = data["lru_hits"] + data["redis_hits"] + data["misses"]
+        data["hit_ratio"] = round((total - data["misses"]) / total, 4) if total else 0.0
+        return data
+
+
+class CachedEmbeddings(Embeddings):
+    """
+    在嵌入模型前加一层查询向量缓存，只缓存 embed_query，文档嵌入直接透传。
+    """
+
+    def __init__(self, embeddings: Embeddings, model: str, cache: EmbeddingCache = None):
+        self.embeddings = embeddings
+        self.model = model
+        self.cache = cache or embedding_cache
+
+    def embed_documents(self, texts: List[str]) -> List[List[float]]:
+        return self.embeddings.embed_documents(texts)
+
+    async def aembed_documents(self, texts: List[str]) -> List[List[float]]:
+        return await self.embeddings.aembed_documents(texts)
+
+    def embed_query(self, text: str) -> List[float]:
+        vector = self.cache.get(self.model, text)
+        if vector is None:
+            vector = self.embeddings.embed_query(text)
+            self.cache.set(self.model, text, vector)
+        return vector
+
+    async def aembed_queries(self, texts: List[str]) -> List[List[float]]:
+        """
+        批量嵌入查询文本：先批量查缓存，未命中的去重后合并为一次嵌入请求。
+        """
+        vectors = await asyncio.to_thread(self.cache.get_many, self.model, texts)
+        missing = list(dict.fromkeys(t for t, v in zip(texts, vectors) if v is None))
+        if missing:
+            embedded = dict(zip(missing, await self.embeddings.aembed_documents(missing)))
+            await asyncio.to_thread(self.cache.set_many, self.model, embedded)
+            vectors = [v if v is not None else embedded[t] for t, v in zip(texts, vectors)]
+        return vectors
+
+    async def aembed_query(self, text: str) -> List[float]:
+        vector = await asyncio.to_thread(self.cache.get, self.model, text)
+        if vector is None:
+            vector = await self.embeddings.aembed_query(text)
+            await asyncio.to_thread(self.cache.set, self.model, text, vector)
+        return vector
+
+
+embedding_cache = EmbeddingCache(
+    os.environ.get("REDIS_URL"),
+    maxsize=int(os.environ.get("EMBEDDING_CACHE_SIZE", 4096)),
+    expire=int(os.environ.get("EMBEDDING_CACHE_TTL", 3600 * 24 * 7)),
+)
@@ -0,0 +1,165 @@
+import asyncio
+import logging
+import os
+import time
+from collections import deque
+from typing import Any, Awaitable, Callable, Dict, Tuple
+
+log = logging.getLogger(__name__)
+
+
+class _RouteState:
+    def __init__(self, max_ratio: float, window: int):
+        self.max_ratio = max_ratio
+        self.latencies = deque(maxlen=window)
+        self.credits = 1.0
+        self.counters = {
+            "requests": 0,
+            "hedged": 0,
+            "hedge_wins": 0,
+            "primary_wins": 0,
+            "budget_skipped": 0,
+        }
+
+
+class HedgePolicy:
+    """
+    对冲请求：主请求在延迟分位数（如 p95）内没有返回时，再发一个相同的请求，
+    取先完成的结果并取消另一个，用少量额外调用削减长尾延迟。
+
+    只对 routes 中配置的路由生效。延迟样本和对冲额度按 (路由, 模型) 分别维护，
+    同一路由上不同模型的延迟分布互不影响。每个 (路由, 模型) 有额外开销上限 max_ratio：每个请求积累
+    max_ratio 个额度，每次对冲消耗 1 个，因此对冲请求数不超过总请求数的 max_ratio（允许 burst 个突发）。
+    """
+
+    def __init__(
+        self,
+        routes: Dict[str, float],
+        percentile: float = 95,
+        min_delay: float = 0.5,
+        initial_delay: float = 10,
+        min_samples: int = 20,
+        window: int = 500,
+        burst: float = 5,
+    ):
+        """
+        :param routes: 路由名到额外开销上限（对冲请求占比）的映射
+        :param percentile: 对冲延迟取最近延迟的该分位数
+        :param min_delay: 最短对冲延迟，单位为秒
+        :param initial_delay: 样本数不足 min_samples 时使用的对冲延迟
+        :param min_samples: 使用分位数前需要的最少样本数
+        :param window: 每个 (路由, 模型) 保留的最近延迟样本数
+        :param burst: 对冲额度的上限
+        """
+        self.routes = dict(routes)
+        self.states: Dict[Tuple[str, str], _RouteState] = {}
+        self.window = window
+        self.percentile = percentile
+        self.min_delay = min_delay
+        self.initial_delay = initial_delay
+        self.min_samples = min_samples
+        self.burst = burst
+
+    def enabled(self, route: str) -> bool:
+        return route in self.routes
+
+    def _state(self, route: str, model: str = None) -> _RouteState:
+        key = (route, model)
+        state = self.states.get(key)
+        if state is None:
+            state = self.states[key] = _RouteState(self.routes[route], self.window)
+        return state
+
+    def delay(self, route: str, model: str = None) -> float:
+        """当前的对冲延迟：该 (路由, 模型) 最近延迟的分位数，不低于 min_delay。"""
+        latencies = sorted(self._state(route, model).latencies)
+        if len(latencies) < self.min_samples:
+            return self.initial_delay
+        index = min(int(len(latencies) * self.percentile / 100), len(latencies) - 1)
+        return max(latencies[index], self.min_delay)
+
+    async def run(
+        self,
+        route: str,
+        primary: Callable[[], Awaitable[Any]],
+        hedge: Callable[[], Awaitable[Any]],
+        model: str = None,
+    ) -> Any:
+        """
+        执行主请求，超过对冲延迟仍未返回且额度充足时发起对冲请求。
+        延迟样本只记录先完成的请求从它自己发出起的耗时，被取消的请求没有完整耗时，不记录。
+
+        Args:
+            route (str): 路由名，未启用对冲的路由直接执行主请求。
+            primary (Callable[[], Awaitable]): 发起主请求的协程函数。
+            hedge (Callable[[], Awaitable]): 发起对冲请求的协程函数，通常发往另一个部署。
+            model (str, optional): 请求的模型，延迟样本和对冲额度按 (路由, 模型) 分别维护。
+
+        Returns:
+            Any: 先成功完成的请求的结果；两个请求都失败时抛出主请求的异常。
+        """
+        if not self.enabled(route):
+            return await primary()
+        state = self._state(route, model)
+        state.counters["requests"] += 1
+        state.credits = min(state.credits + state.max_ratio, self.burst)
+        first = asyncio.ensure_future(primary())
+        tasks = [first]
+        starts = {first: time.monotonic()}
+        try:
+            done, _ = await asyncio.wait(tasks, timeout=self.delay(route, model))
+            if not done and state.credits < 1:
+                state.counters["budget_skipped"] += 1
+            elif not done:
+                state.credits -= 1
+                state.counters["hedged"] += 1
+                second = asyncio.ensure_future(hedge())
+                tasks.append(second)
+                starts[second] = time.monotonic()
+            pending = set(tasks)
+            while pending:
+                done, pending = await asyncio.wait(pending, return_when=asyncio.FIRST_COMPLETED)
+                for task in done:
+                    if task.exception() is None:
+                        state.latencies.append(time.monotonic() - starts[task])
+                        if len(tasks) > 1:
+                            won = "hedge_wins" if task is not first else "primary_wins"
+                            state.counters[won] += 1
+                        return task.result()
+            return first.result()
+        finally:
+            for task in tasks:
+                if not task.done():
+                    task.cancel()
+
+    def stats(self) -> dict:
+        """按 "路由:模型" 汇总的计数、当前对冲延迟和对冲获胜率。"""
+        result = {}
+        for (route, model), state in list(self.states.items()):
+            hedged = state.counters["hedged"]
+            result[f"{route}:{model}" if model else route] = dict(
+                state.counters,
+                max_ratio=state.max_ratio,
+                delay=round(self.delay(route, model), 4),
+                hedge_win_ratio=round(state.counters["hedge_wins"] / hedged, 4) if hedged else 0.0,
+            )
+        return result
+
+
+def load_hedge_policy() -> HedgePolicy:
+    """
+    从环境变量创建对冲策略。LLM_HEDGE_ROUTES 为逗号分隔的路由列表，可带额外开销上限，
+    例如 "json:0.05,text"，未写上限的路由使用 LLM_HEDGE_MAX_RATIO；为空时不启用对冲。
+    """
+    max_ratio = float(os.environ.get("LLM_HEDGE_MAX_RATIO", 0.05))
+    routes = {}
+    for item in os.environ.get("LLM_HEDGE_ROUTES", "").split(","):
+        route, _, ratio = item.strip().partition(":")
+        if route:
+            routes[route] = float(ratio) if ratio else max_ratio
+    return HedgePolicy(
+        routes,
+        percentile=float(os.environ.get("LLM_HEDGE_PERCENTILE", 95)),
+        min_delay=float(os.environ.get("LLM_HEDGE_MIN_DELAY", 0.5)),
+        initial_delay=float(os.environ.get("LLM_HEDGE_INITIAL_DELAY", 10)),
+    )
@@ -0,0 +1,337 @@
+import json
+import logging
+import os
+import threading
+import time
+import uuid
+from typing import List, Optional
+
+import numpy as np
+import redis
+
+log = logging.getLogger(__name__)
+
+VECTOR_DTYPES = ("FLOAT32", "FLOAT16", "INT8")
+BACKENDS = ("redis", "pgvector")
+FILTER_FIELD_TYPES = ("tag", "numeric")
+DEFAULT_FILTER_FIELDS = {"blob_name": "tag", "blob_uri": "tag"}
+# 未保存 metadata_schema 的旧索引由 langchain 按元数据推断建字段，字符串元数据为 TEXT 字段
+LEGACY_METADATA_SCHEMA = {"text": [{"name": name} for name in DEFAULT_FILTER_FIELDS]}
+
+
+class FilterError(ValueError):
+    """元数据过滤条件无效：字段未建索引、操作符与字段类型不匹配或操作符不支持。"""
+
+
+def filter_values(f: dict) -> list:
+    """eq / in / prefix 条件的取值列表，取值缺失、为 None 或为空列表时抛出 FilterError。"""
+    value = f.get("value")
+    values = value if isinstance(value, list) else [value]
+    if not values or any(v is None for v in values):
+        raise FilterError(f"Operator {f.get('op', 'eq')} on {f['field']} requires a non-null value")
+    return values
+
+
+class IndexConfig:
+    """
+    索引级配置，以 JSON 形式保存在 Redis 键 ragmeta:{index} 中。
+
+    vector_dtype 为 FLOAT16 或 INT8 时为紧凑存储：FLOAT16 直接半精度存储，
+    INT8 使用按维度对称缩放的标量量化，缩放系数（codebook）随索引一起保存，
+    检索使用内积距离，可选用原始精度查询向量对候选结果精确重排。
+
+    dimensions 为索引声明的嵌入维度，写入和查询都按该维度请求嵌入并校验。
+
+    filter_fields 声明可用于预过滤的元数据字段及其类型（tag / numeric），
+    建索引时按该类型创建字段，实际生效的字段定义保存在 metadata_schema 中。
+
+    backend 为索引所在的向量库（redis / pgvector），backend_options 为该向量库的索引选项。
+
+    revision 在每次保存时更新，进程内缓存的向量库实例据此判断配置是否已被其他进程修改或删除。
+    """
+
+    def __init__(
+        self,
+        vector_dtype: str = "FLOAT32",
+        codebook: List[float] = None,
+        rescore: bool = None,
+        dimensions: int = None,
+        filter_fields: dict = None,
+        metadata_schema: dict = None,
+        backend: str = "redis",
+        backend_options: dict = None,
+        revision: str = None,
+        **extra,
+    ):
+        vector_dtype = vector_dtype.upper()
+        if vector_dtype not in VECTOR_DTYPES:
+            raise ValueError(f"Unsupported vector dtype {vector_dtype}, expected one of {VECTOR_DTYPES}")
+        self.vector_dtype = vector_dtype
+        self.codebook = codebook
+        self.rescore = vector_dtype == "INT8" if rescore is None else rescore
+        self.dimensions = dimensions
+        self.filter_fields = dict(DEFAULT_FILTER_FIELDS if filter_fields is None else filter_fields)
+        for name, kind in self.filter_fields.items():
+            if kind not in FILTER_FIELD_TYPES:
+                raise ValueError(f"Unsupported filter field type {kind} for {name}, expected one of {FILTER_FIELD_TYPES}")
+        self.metadata_schema = metadata_schema
+        if backend not in BACKENDS:
+            raise ValueError(f"Unsupported backend {backend}, expected one of {BACKENDS}")
+        if backend != "redis" and vector_dtype != "FLOAT32":
+            raise ValueError(f"Backend {backend} only stores FLOAT32 vectors")
+        self.backend = backend
+        self.backend_options = backend_options or {}
+        self.revision = revision
+        self.extra = extra
+
+    @property
+    def compact(self) -> bool:
+        return self.vector_dtype != "FLOAT32"
+
+    @property
+    def needs_codebook(self) -> bool:
+        """INT8 索引在首批向量写入前还没有 codebook，此时无法编码和解码向量。"""
+        return self.vector_dtype == "INT8" and not self.codebook
+
+    @property
+    def distance_metric(self) -> str:
+        return "IP" if self.vector_dtype == "INT8" else "COSINE"
+
+    def to_dict(self) -> dict:
+        return dict(
+            vector_dtype=self.vector_dtype,
+            codebook=self.codebook,
+            rescore=self.rescore,
+            dimensions=self.dimensions,
+            filter_fields=self.filter_fields,
+            metadata_schema=self.metadata_schema,
+            backend=self.backend,
+            backend_options=self.backend_options,
+            revision=self.revision,
+            **self.extra,
+        )
+
+    def embedding_label(self, model: str) -> str:
+        """嵌入模型标识，降维索引附带维度，用于缓存键和文本块指纹。"""
+        return f"{model}@{self.dimensions}" if self.dimensions else model
+
+    def check_dimensions(self, vector: List[float], index_name: str):
+        """向量维度与索引声明不一致时抛出 ValueError。"""
+        if self.dimensions and len(vector) != self.dimensions:
+            raise ValueError(
+                f"Embedding has {len(vector)} dimensions but index {index_name} "
+                f"expects {self.dimensions}"
+            )
+
+    def field_type(self, name: str) -> Optional[str]:
+        """
+        返回元数据字段在索引中的类型（tag / numeric / text），不存在时返回 None。
+        没有 metadata_schema 的旧索引按 LEGACY_METADATA_SCHEMA 处理。
+        """
+        schema = LEGACY_METADATA_SCHEMA if self.metadata_schema is None else self.metadata_schema
+        for kind, fields in schema.items():
+            if any(f["name"] == name for f in fields):
+                return kind
+        return None
+
+    def fit_codebook(self, vectors: List[List[float]], headroom: float = 1.25):
+        """用首批向量的按维度绝对值最大值拟合 INT8 缩放系数。"""
+        absmax = np.abs(np.asarray(vectors, dtype=np.float32)).max(axis=0) * headroom
+        self.codebook = (np.maximum(absmax, 1e-6) / 127.0).tolist()
+
+    def encode(self, vector: List[float]) -> bytes:
+        """把文档向量编码为 Redis 中存储的字节。"""
+        array = np.asarray(vector, dtype=np.float32)
+        if self.vector_dtype == "FLOAT16":
+            return array.astype(np.float16).tobytes()
+        if self.vector_dtype == "INT8":
+            scale = np.asarray(self.codebook, dtype=np.float32)
+            return np.clip(np.rint(array / scale), -127, 127).astype(np.int8).tobytes()
+        return array.tobytes()
+
+    def encode_query(self, vector: List[float]) -> bytes:
+        """
+        编码查询向量。INT8 索引先乘以缩放系数再整体量化，
+        使量化后的内积与原始内积只差一个正的常数因子，排序不变。
+        """
+        if self.vector_dtype != "INT8":
+            return self.encode(vector)
+        array = np.asarray(vector, dtype=np.float32) * np.asarray(self.codebook, dtype=np.float32)
+        scale = np.abs(array).max() / 127.0 or 1.0
+        return np.clip(np.rint(array / scale), -127, 127).astype(np.int8).tobytes()
+
+    def decode(self, buffer: bytes) -> np.ndarray:
+        """把 Redis 中存储的字节还原为 float32 向量。"""
+        if self.vector_dtype == "FLOAT16":
+            return np.frombuffer(buffer, dtype=np.float16).astype(np.float32)
+        if self.vector_dtype == "INT8":
+            scale = np.asarray(self.codebook, dtype=np.float32)
+            return np.frombuffer(buffer, dtype=np.int8).astype(np.float32) * scale
+        return np.frombuffer(buffer, dtype=np.float32)
+
+    def save(self, client: redis.Redis, index_name: str):
+        self.revision = uuid.uuid4().hex
+        client.set(f"ragmeta:{index_name}", json.dumps(self.to_dict()))
+        _config_cache.pop(index_name, None)
+
+    @staticmethod
+    def load(client: redis.Redis, index_name: str, ttl: int = 60) -> "IndexConfig":
+        """
+        读取索引配置，未配置的索引返回默认 FLOAT32 配置。进程内缓存 ttl 秒。
+        还没有 codebook 的 INT8 配置每次重新读取，其他进程写入 codebook 后立即可见。
+        """
+        cached = _config_cache.get(index_name)
+        if cached and not cached[0].needs_codebook and time.monotonic() - cached[1] < ttl:
+            return cached[0]
+        value = client.get(f"ragmeta:{index_name}")
+        config = IndexConfig(**json.loads(value)) if value else IndexConfig()
+        with _config_lock:
+            _config_cache[index_name] = (config, time.monotonic())
+        return config
+
+    @staticmethod
+    def delete(client: redis.Redis, index_name: str):
+        client.unlink(f"ragmeta:{index_name}")
+        _config_cache.pop(index_name, None)
+
+
+_config_lock = threading.Lock()
+_config_cache = {}
+
+
+def versioned_index_name(index_name: str) -> str:
+    """重建索引时新物理索引的名称：{index}@v{毫秒时间戳}。"""
+    return f"{index_name}@v{int(time.time() * 1000)}"
+
+
+def index_key_prefix(index_name: str) -> str:
+    """
+    物理索引的文档键前缀，文档键为 {prefix}:{id}。
+
+    新建索引注册的 RediSearch 前缀带结尾冒号，但旧索引注册的是不带冒号的 doc:{index}，
+    会收录所有以它开头的键。重建产生的版本（{index}@v{ts}）因此使用单独的 ragdoc 命名空间，
+    重建期间写入的文档不会被仍在服务的旧索引收录。
+    """
+    if "@v" in index_name:
+        return f"ragdoc:{index_name}"
+    return f"doc:{index_name}"
+
+
+def get_index_version(client: redis.Redis, index_name: str) -> int:
+    """返回索引内容的版本号，入库或删除索引时递增，用于使检索结果缓存失效。"""
+    return int(client.get(f"ragver:{index_name}") or 0)
+
+
+def index_results_key(index_name: str, version) -> str:
+    """登记某个索引版本下检索结果缓存键的集合。"""
+    return f"ragresults:{index_name}:{version}"
+
+
+def result_grace_ttl() -> int:
+    """索引版本更替后旧检索结果的保留时间（RAG_RESULT_GRACE_TTL，默认一天）。"""
+    return int(os.environ.get("RAG_RESULT_GRACE_TTL", 3600 * 24))
+
+
+def bump_index_version(client: redis.Redis, index_name: str, grace: int = None) -> int:
+    """递增版本号，上一版本登记的检索结果缓存在 grace 秒后过期。"""
+    version = client.incr(f"ragver:{index_name}")
+    retire_index_results(client, index_name, version - 1, grace)
+    return version
+
+
+def retire_index_results(
+    client: redis.Redis, index_name: str, version, grace: int = None, batch_size: int = 500
+) -> int:
+    """
+    让某个索引版本下登记的检索结果缓存在 grace 秒后过期（grace 为 0 时立即删除），
+    已分享的结果链接在宽限期内仍可访问，旧版本的结果不会存活到命名空间 TTL。
+
+    Args:
+        client (redis.Redis): Redis 客户端。
+        index_name (str): 物理索引名称。
+        version: 索引版本号。
+        grace (int, optional): 宽限时间，单位为秒，默认取 result_grace_ttl()。
+        batch_size (int, optional): 每个 pipeline 处理的键数。
+
+    Returns:
+        int: 处理的结果键数量。
+    """
+    if grace is None:
+        grace = result_grace_ttl()
+    key = index_results_key(index_name, version)
+    count, batch = 0, []
+    for member in client.sscan_iter(key, count=batch_size):
+        batch.append(member)
+        if len(batch) >= batch_size:
+            count += _expire_batch(client, batch, grace)
+            batch = []
+    if batch:
+        count += _expire_batch(client, batch, grace)
+    client.unlink(key)
+    return count
+
+
+def _expire_batch(client: redis.Redis, keys: list, grace: int) -> int:
+    pipe = client.pipeline(transaction=False)
+    if grace > 0:
+        for key in keys:
+            pipe.expire(key, grace)
+    else:
+        pipe.unlink(*keys)
+    pipe.execute()
+    return len(keys)
+
+
+_alias_cache = {}
+
+
+def resolve_index(client: redis.Redis, index_name: str, ttl: float = 5) -> str:
+    """
+    返回逻辑索引当前指向的物理索引（别名保存在 ragalias:{index} 中），
+    未建立别名的索引返回自身。进程内缓存 ttl 秒。
+    """
+    cached = _alias_cache.get(index_name)
+    if cached and time.monotonic() - cached[1] < ttl:
+        return cached[0]
+    value = client.get(f"ragalias:{index_name}")
+    physical = value.decode() if isinstance(value, bytes) else value or index_name
+    with _config_lock:
+        _alias_cache[index_name] = (physical, time.monotonic())
+    return physical
+
+
+def set_index_alias(client: redis.Redis, index_name: str, physical_name: str) -> str:
+    """原子地把逻辑索引切换到新的物理索引，返回切换前指向的物理索引。"""
+    old = client.set(f"ragalias:{index_name}", physical_name, get=True)
+    _alias_cache.pop(index_name, None)
+    old = old.decode() if isinstance(old, bytes) else old
+    return old or index_name
+
+
+def delete_index_alias(client: redis.Redis, index_name: str):
+    client.unlink(f"ragalias:{index_name}")
+    _alias_cache.pop(index_name, None)
+
+
+def rescore(query: List[float], candidates: list, config: IndexConfig, k: int) -> list:
+    """
+    用原始精度的查询向量对候选结果精确重排。
+
+    Args:
+        query (List[float]): 查询向量。
+        candidates (list): (Document, score, vector_bytes) 列表。
+        config (IndexConfig): 索引配置，用于解码向量。
+        k (int): 返回条数。
+
+    Returns:
+        list: 按余弦相似度降序的 (Document, score) 列表。
+    """
+    if not candidates:
+        return []
+    q = np.asarray(query, dtype=np.float32)
+    q /= np.linalg.norm(q) or 1.0
+    matrix = np.vstack([config.decode(c[2]) for c in candidates])
+    norms = np.linalg.norm(matrix, axis=1)
+    scores = matrix @ q / np.where(norms == 0, 1, norms)
+    order = np.argsort(-scores)[:k]
+    return [(candidates[i][0], float(scores[i])) for i in order]
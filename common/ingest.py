@@ -0,0 +1,550 @@
+import asyncio
+import concurrent.futures
+import hashlib
+import json
+import logging
+import random
+import threading
+import uuid
+from concurrent.futures import Executor
+from typing import Callable, List, Optional
+
+import openai
+import redis
+from langchain_core.documents import Document
+from langchain_text_splitters import RecursiveCharacterTextSplitter
+from langchain_community.vectorstores.redis import Redis
+from langchain_community.vectorstores.redis.base import (
+    _generate_field_schema,
+    _prepare_metadata,
+    check_index_exists,
+)
+from redis.commands.search.field import VectorField
+from redis.commands.search.indexDefinition import IndexDefinition, IndexType
+
+from common.indexconfig import IndexConfig, bump_index_version, index_key_prefix
+
+log = logging.getLogger(__name__)
+
+_DONE = object()
+
+
+def chunk_fingerprint(text: str, model: str, metadata: dict = None) -> str:
+    """
+    计算文本块指纹：归一化文本 + 嵌入模型 + 元数据的 sha256。
+    元数据参与计算，不同文件中的相同文本块是不同的记录，只改元数据的文本块也会重新写入。
+
+    Args:
+        text (str): 文本块内容。
+        model (str): 嵌入模型名称。
+        metadata (dict, optional): 标识文本块来源的元数据。
+
+    Returns:
+        str: 十六进制指纹。
+    """
+    normalized = " ".join(text.split())
+    source = json.dumps(metadata or {}, sort_keys=True, ensure_ascii=False, default=str)
+    return hashlib.sha256(f"{model}\0{normalized}\0{source}".encode()).hexdigest()
+
+
+def apply_metadata(docs: List[Document], metadata: dict = None) -> List[Document]:
+    if metadata:
+        for doc in docs:
+            if not doc.metadata:
+                doc.metadata = {}
+            doc.metadata.update(metadata)
+    return docs
+
+
+def split_file(
+    filepath: str, splitter: RecursiveCharacterTextSplitter, metadata: dict = None
+) -> List[Document]:
+    """
+    解析文件并切分为文本块。参数和返回值均可序列化，可直接提交到进程池执行。
+
+    Args:
+        filepath (str): 文件路径。
+        splitter (RecursiveCharacterTextSplitter): 文本切分器。
+        metadata (dict, optional): 附加到每个文本块的元数据。
+
+    Returns:
+        List[Document]: 文本块列表。
+    """
+    from common.redisrag import get_loader_from_file
+
+    docs = get_loader_from_file(filepath).load()
+    return splitter.split_documents(apply_metadata(docs, metadata))
+
+
+class IngestPipeline:
+    """
+    文档入库流水线：加载 -> 切分 -> 批量嵌入 -> 管道化 HSET 写入。
+
+    各阶段之间通过有界队列衔接，队列满时上游阻塞（背压），
+    每个阶段的并发度独立可配，嵌入阶段遇到 429 时按 Retry-After 退避重试。
+
+    每个索引在 Redis 中维护一个指纹集合 ragfp:{index}，文档键由指纹派生，
+    已入库的文本块不会重复嵌入；sync=True 时删除本次未出现的旧文本块。
+    指纹包含调用方为文件传入的元数据（如 blob_name），未传入时使用文本块自身的元数据。
+    """
+
+    def __init__(
+        self,
+        indexname: str,
+        embeddings,
+        redis_url: str,
+        embedding_model: str,
+        client: redis.Redis = None,
+        vector_schema: dict = None,
+        index_config: IndexConfig = None,
+        splitlen: int = 1024,
+        length_function: Callable[[str], int] = len,
+        embed_batch_size: int = 64,
+        write_batch_size: int = 500,
+        load_concurrency: int = 4,
+        embed_concurrency: int = 4,
+        queue_size: int = 8,
+        max_retries: int = 6,
+        streaming: bool = True,
+        progress_callback: Callable[[dict], None] = None,
+        executor: Executor = None,
+        store=None,
+    ):
+        """
+        :param indexname: 索引名称
+        :param embeddings: langchain Embeddings 实例
+        :param redis_url: Redis 连接 URL
+        :param embedding_model: 嵌入模型名称，参与文本块指纹计算
+        :param client: 用于指纹索引读写的 Redis 客户端
+        :param vector_schema: 向量字段定义，新建索引时使用
+        :param index_config: 索引配置，决定向量的存储类型
+        :param splitlen: 切分长度（由 length_function 计量）
+        :param embed_batch_size: 每次嵌入请求的文本块数量
+        :param write_batch_size: 每次 pipeline.execute 的 HSET 数量
+        :param load_concurrency: 同时解析的文件数
+        :param embed_concurrency: 同时进行的嵌入请求数
+        :param queue_size: 阶段间队列容量（单位为批）
+        :param max_retries: 嵌入请求遇到 429 时的最大重试次数
+        :param streaming: 为 True 时使用 lazy_load 逐文档切分并按批下发，内存占用与批大小成正比
+        :param progress_callback: 进度回调，参数为 stats 字典
+        :param executor: 进程池，设置后文件解析和切分在池中执行（此时不使用 streaming）
+        :param store: 外部向量库（如 PgVectorStore），设置后文本块写入该库，指纹集合仍保存在 Redis
+        """
+        self.indexname = indexname
+        self.embeddings = embeddings
+        self.redis_url = redis_url
+        self.embedding_model = embedding_model
+        self.client = client or redis.Redis.from_url(redis_url)
+        self.vector_schema = vector_schema
+        self.index_config = index_config or IndexConfig()
+        self.fingerprint_key = f"ragfp:{indexname}"
+        self.run_key = f"ragfp:{indexname}:run:{uuid.uuid4().hex}"
+        self.splitter = RecursiveCharacterTextSplitter(
+            chunk_size=splitlen, chunk_overlap=0, length_function=length_function
+        )
+        self.embed_batch_size = embed_batch_size
+        self.write_batch_size = write_batch_size
+        self.load_concurrency = load_concurrency
+        self.embed_concurrency = embed_concurrency
+        self.queue_size = queue_size
+        self.max_retries = max_retries
+        self.streaming = streaming
+        self.progress_callback = progress_callback
+        self.executor = executor
+        self.store = store
+        self.vectordb: Optional[Redis] = None
+        self._index_ready = False
+        self.stats = {
+            "files_total": 0,
+            "files_parsed": 0,
+            "chunks_split": 0,
+            "chunks_skipped": 0,
+            "chunks_embedded": 0,
+            "chunks_written": 0,
+            "chunks_deleted": 0,
+        }
+
+    def _progress(self, name: str, count: int = 1):
+        self.stats[name] += count
+        if self.progress_callback:
+            self.progress_callback(dict(self.stats))
+
+    def load_and_split(self, filepath: str, metadata: dict = None) -> List[Document]:
+        return split_file(filepath, self.splitter, metadata)
+
+    def stream_and_split(
+        self, filepath: str, metadata: dict, emit: Callable[[List[Document]], None]
+    ):
+        """
+        逐个文档加载并切分，每凑满 embed_batch_size 个文本块就交给 emit。
+
+        emit 在下游队列满时阻塞，因此单个文件的内存占用只与批大小相关。
+        """
+        from common.redisrag import get_loader_from_file
+
+        batch: List[Document] = []
+        for doc in get_loader_from_file(filepath).lazy_load():
+            chunks = self.splitter.split_documents(apply_metadata([doc], metadata))
+            for chunk in chunks:
+                batch.append(chunk)
+                if len(batch) >= self.embed_batch_size:
+                    emit(batch)
+                    batch = []
+        if batch:
+            emit(batch)
+
+    async def _load_stage(self, filepaths, metadatas, batch_queue: asyncio.Queue):
+        loop = asyncio.get_running_loop()
+        semaphore = asyncio.Semaphore(self.load_concurrency)
+        stopped = threading.Event()
+
+        async def put(batch: List[Document], metadata: dict):
+            self._progress("chunks_split", len(batch))
+            await batch_queue.put((batch, metadata))
+
+        def emit(batch: List[Document], metadata: dict):
+            # 流水线失败或被取消后队列不再有人消费，loader 线程放弃等待并退出
+            future = asyncio.run_coroutine_threadsafe(put(batch, metadata), loop)
+            while True:
+                if stopped.is_set():
+                    future.cancel()
+                    raise concurrent.futures.CancelledError()
+                try:
+                    return future.result(timeout=0.5)
+                except concurrent.futures.TimeoutError:
+                    pass
+
+        async def load_one(i: int, filepath: str):
+            metadata = metadatas[i] if metadatas and i < len(metadatas) else None
+            async with semaphore:
+                if self.executor is None and self.streaming:
+                    await asyncio.to_thread(
+                        self.stream_and_split,
+                        filepath,
+                        metadata,
+                        lambda batch: emit(batch, metadata),
+                    )
+                else:
+                    if self.executor is not None:
+                        chunks = await loop.run_in_executor(
+                            self.executor, split_file, filepath, self.splitter, metadata
+                        )
+                    else:
+                        chunks = await asyncio.to_thread(self.load_and_split, filepath, metadata)
+                    for j in range(0, len(chunks), self.embed_batch_size):
+                        await put(chunks[j : j + self.embed_batch_size], metadata)
+            self._progress("files_parsed")
+
+        try:
+            async with asyncio.TaskGroup() as tg:
+                for i, filepath in enumerate(filepaths):
+                    tg.create_task(load_one(i, filepath))
+        finally:
+            stopped.set()
+
+    async def _embed_with_retry(self, texts: List[str]) -> List[List[float]]:
+        delay = 1.0
+        for attempt in range(self.max_retries + 1):
+            try:
+                # 同步客户端在线程中调用，避免共享的异步连接池绑定到某个事件循环
+                return await asyncio.to_thread(self.embeddings.embed_documents, texts)
+            except openai.RateLimitError as e:
+                if attempt >= self.max_retries:
+                    raise
+                retry_after = e.response.headers.get("retry-after") if e.response else None
+                wait = float(retry_after) if retry_after else delay
+                wait += random.uniform(0, wait / 4)
+                log.warning(f"embedding rate limited, retry in {wait:.1f}s")
+                await asyncio.sleep(wait)
+                delay = min(delay * 2, 60)
+
+    def _filter_new(self, batch: List[Document], metadata: dict = None):
+        """
+        按指纹过滤已入库的文本块，并把本批指纹记录到本次运行集合。
+        metadata 为调用方传入的文件元数据，为空时按每个文本块自身的元数据计算指纹。
+        """
+        unique = {}
+        for doc in batch:
+            fp = chunk_fingerprint(doc.page_content, self.embedding_model, metadata or doc.metadata)
+            unique.setdefault(fp, doc)
+        fingerprints = list(unique)
+        exists = self.client.smismember(self.fingerprint_key, fingerprints)
+        pipe = self.client.pipeline(transaction=False)
+        pipe.sadd(self.run_key, *fingerprints)
+        pipe.expire(self.run_key, 3600 * 24)
+        pipe.execute()
+        new_fps = [fp for fp, found in zip(fingerprints, exists) if not found]
+        return [unique[fp] for fp in new_fps], new_fps
+
+    async def _embed_stage(self, batch_queue: asyncio.Queue, write_queue: asyncio.Queue):
+        while True:
+            item = await batch_queue.get()
+            if item is _DONE:
+                await batch_queue.put(_DONE)
+                return
+            batch, metadata = item
+            size = len(batch)
+            batch, fingerprints = await asyncio.to_thread(self._filter_new, batch, metadata)
+            self._progress("chunks_skipped", size - len(batch))
+            if not batch:
+                continue
+            vectors = await self._embed_with_retry([d.page_content for d in batch])
+            self._progress("chunks_embedded", len(batch))
+            await write_queue.put((batch, vectors, fingerprints))
+
+    def _metadata_schema(self, metadata: dict = None) -> dict:
+        """
+        由首个文本块的元数据推断字段类型，声明为过滤字段的按 TAG/NUMERIC 建索引。
+        """
+        schema = {"text": [], "numeric": [], "tag": []}
+        if metadata:
+            for kind, fields in _generate_field_schema(metadata).items():
+                schema[kind].extend(fields)
+        declared = self.index_config.filter_fields
+        for kind in schema:
+            schema[kind] = [f for f in schema[kind] if f["name"] not in declared]
+        for name, kind in declared.items():
+            schema[kind].append({"name": name})
+        return schema
+
+    def _get_vectordb(self, metadata: dict = None) -> Redis:
+        if self.vectordb is None:
+            self.vectordb = Redis(
+                redis_url=self.redis_url,
+                index_name=self.indexname,
+                embedding=self.embeddings,
+                index_schema=self.index_config.metadata_schema or self._metadata_schema(metadata),
+                vector_schema=self.vector_schema,
+                key_prefix=index_key_prefix(self.indexname),
+            )
+        return self.vectordb
+
+    def _create_index(self, vectordb: Redis, vectors: List[List[float]]):
+        """
+        创建 RediSearch 索引。langchain 只支持 FLOAT32/FLOAT64，且注册的键前缀不带结尾冒号，
+        会收录其他以相同字符串开头的索引的文档，因此所有类型的索引都由这里直接创建。
+        """
+        config = self.index_config
+        schema = vectordb._schema
+        fields = [
+            f for f in schema.get_fields() if f.name != schema.content_vector_key
+        ]
+        fields.append(
+            VectorField(
+                schema.content_vector_key,
+                (self.vector_schema or {}).get("algorithm", "HNSW").upper(),
+                {
+                    "TYPE": config.vector_dtype,
+                    "DIM": len(vectors[0]),
+                    "DISTANCE_METRIC": config.distance_metric,
+                },
+            )
+        )
+        self.client.ft(self.indexname).create_index(
+            fields,
+            definition=IndexDefinition(
+                prefix=[f"{vectordb.key_prefix}:"], index_type=IndexType.HASH
+            ),
+        )
+
+    def _ensure_index(self, metadata: dict, vectors: List[List[float]]) -> Redis:
+        """首次写入时创建索引，并把元数据字段定义和 INT8 codebook 保存到索引配置。"""
+        vectordb = self._get_vectordb(metadata)
+        if self._index_ready:
+            return vectordb
+        config = self.index_config
+        changed = False
+        if config.vector_dtype == "INT8" and not config.codebook:
+            config.fit_codebook(vectors)
+            changed = True
+        # langchain 的 add_texts 按 schema 中的维度校验向量
+        vectordb._schema.content_vector.dims = len(vectors[0])
+        if not check_index_exists(self.client, self.indexname):
+            self._create_index(vectordb, vectors)
+            if config.metadata_schema is None:
+                config.metadata_schema = self._metadata_schema(metadata)
+                changed = True
+        if changed:
+            config.save(self.client, self.indexname)
+            # 首次入库前被查询过的索引，注册表中的向量库还没有元数据字段，需要重建
+            from common.redisrag import vectordb_registry
+
+            vectordb_registry.invalidate(self.indexname)
+        self._index_ready = True
+        return vectordb
+
+    def _write_compact(self, vectordb: Redis, texts, metadatas, vectors, fingerprints):
+        schema = vectordb._schema
+        pipe = self.client.pipeline(transaction=False)
+        for i, (text, metadata, vector, fp) in enumerate(
+            zip(texts, metadatas, vectors, fingerprints), 1
+        ):
+            pipe.hset(
+                f"{vectordb.key_prefix}:{fp}",
+                mapping={
+                    schema.content_key: text,
+                    schema.content_vector_key: self.index_config.encode(vector),
+                    **_prepare_metadata(metadata),
+                },
+            )
+            if i % self.write_batch_size == 0:
+                pipe.execute()
+        pipe.execute()
+
+    def _write(self, batch: List[Document], vectors: List[List[float]], fingerprints: List[str]):
+        self.index_config.check_dimensions(vectors[0], self.indexname)
+        texts = [d.page_content for d in batch]
+        metadatas = [d.metadata or {} for d in batch]
+        vectordb = self._ensure_index(metadatas[0], vectors)
+        if self.index_config.compact:
+            self._write_compact(vectordb, texts, metadatas, vectors, fingerprints)
+        else:
+            vectordb.add_texts(
+                texts,
+                metadatas,
+                embeddings=vectors,
+                keys=fingerprints,
+                batch_size=self.write_batch_size,
+            )
+        self.client.sadd(self.fingerprint_key, *fingerprints)
+
+    async def _write_store(
+        self, batch: List[Document], vectors: List[List[float]], fingerprints: List[str]
+    ):
+        self.index_config.check_dimensions(vectors[0], self.indexname)
+        if not self._index_ready:
+            await self.store.ensure_table(len(vectors[0]))
+            self._index_ready = True
+        await self.store.add(
+            fingerprints,
+            [d.page_content for d in batch],
+            [d.metadata or {} for d in batch],
+            vectors,
+        )
+        await asyncio.to_thread(self.client.sadd, self.fingerprint_key, *fingerprints)
+
+    async def _write_stage(self, write_queue: asyncio.Queue):
+        while True:
+            item = await write_queue.get()
+            if item is _DONE:
+                return
+            batch, vectors, fingerprints = item
+            if self.store is not None:
+                await self._write_store(batch, vectors, fingerprints)
+            else:
+                await asyncio.to_thread(self._write, batch, vectors, fingerprints)
+            self._progress("chunks_written", len(batch))
+
+    def _stale_fingerprints(self) -> List[str]:
+        return [
+            fp.decode() if isinstance(fp, bytes) else fp
+            for fp in self.client.sdiff(self.fingerprint_key, self.run_key)
+        ]
+
+    async def _prune_store(self, batch_size: int = 500):
+        stale = await asyncio.to_thread(self._stale_fingerprints)
+        for i in range(0, len(stale), batch_size):
+            part = stale[i : i + batch_size]
+            await self.store.delete(part)
+            await asyncio.to_thread(self.client.srem, self.fingerprint_key, *part)
+            self._progress("chunks_deleted", len(part))
+
+    def _prune(self, batch_size: int = 500):
+        """删除指纹集合中存在、但本次运行未出现的文本块。"""
+        key_prefix = self._get_vectordb().key_prefix
+        stale = self._stale_fingerprints()
+        for i in range(0, len(stale), batch_size):
+            part = stale[i : i + batch_size]
+            pipe = self.client.pipeline(transaction=False)
+            pipe.unlink(*[f"{key_prefix}:{fp}" for fp in part])
+            pipe.srem(self.fingerprint_key, *part)
+            pipe.execute()
+            self._progress("chunks_deleted", len(part))
+
+    async def _texts_stage(self, texts, metadatas, batch_queue: asyncio.Queue):
+        for i in range(0, len(texts), self.embed_batch_size):
+            batch = [
+                Document(
+                    page_content=text,
+                    metadata=metadatas[i + j] if metadatas else {},
+                )
+                for j, text in enumerate(texts[i : i + self.embed_batch_size])
+            ]
+            self._progress("chunks_split", len(batch))
+            await batch_queue.put((batch, None))
+
+    async def run(
+        self, filepaths: List[str], metadatas: List[dict] = None, sync: bool = False
+    ) -> Redis:
+        """
+        执行入库流水线。
+
+        Args:
+            filepaths (List[str]): 文件路径列表。
+            metadatas (List[dict], optional): 与 filepaths 一一对应的元数据。
+            sync (bool, optional): 为 True 时视本次输入为索引全集，删除未出现的旧文本块。
+
+        Returns:
+            Redis: 写入完成的向量库实例。
+        """
+        self.stats["files_total"] = len(filepaths)
+        return await self._run(
+            lambda queue: self._load_stage(filepaths, metadatas, queue), sync
+        )
+
+    async def run_texts(
+        self, texts: List[str], metadatas: List[dict] = None, sync: bool = False
+    ) -> Redis:
+        """
+        将已切分的文本直接送入嵌入和写入阶段。
+
+        Args:
+            texts (List[str]): 文本列表。
+            metadatas (List[dict], optional): 与 texts 一一对应的元数据。
+            sync (bool, optional): 为 True 时视本次输入为索引全集，删除未出现的旧文本块。
+
+        Returns:
+            Redis: 写入完成的向量库实例。
+        """
+        return await self._run(
+            lambda queue: self._texts_stage(texts, metadatas, queue), sync
+        )
+
+    def _finish_run(self):
+        self.client.delete(self.run_key)
+        if self.stats["chunks_written"] or self.stats["chunks_deleted"]:
+            bump_index_version(self.client, self.indexname)
+
+    async def _run(self, producer, sync: bool) -> Redis:
+        batch_queue = asyncio.Queue(maxsize=self.queue_size)
+        write_queue = asyncio.Queue(maxsize=self.queue_size)
+
+        async def produce():
+            # 出错时不写入结束标记：队列可能已满且下游已被取消，TaskGroup 会取消其余阶段
+            await producer(batch_queue)
+            await batch_queue.put(_DONE)
+
+        async def embed():
+            async with asyncio.TaskGroup() as tg:
+                for _ in range(self.embed_concurrency):
+                    tg.create_task(self._embed_stage(batch_queue, write_queue))
+            await write_queue.put(_DONE)
+
+        try:
+            async with asyncio.TaskGroup() as tg:
+                tg.create_task(produce())
+                tg.create_task(embed())
+                tg.create_task(self._write_stage(write_queue))
+
+            if not self.stats["chunks_split"]:
+                raise ValueError("No documents were loaded from the provided filepaths.")
+            if sync and self.store is not None:
+                await self._prune_store()
+            elif sync:
+                await asyncio.to_thread(self._prune)
+        finally:
+            await asyncio.to_thread(self._finish_run)
+        log.info(f"ingest {self.indexname} done: {self.stats}")
+        if self.store is not None:
+            return self.store
+        return await asyncio.to_thread(self._get_vectordb)
@@ -0,0 +1,138 @@
+import asyncio
+import json
+import logging
+import threading
+import time
+import uuid
+from typing import Optional
+
+import redis
+
+log = logging.getLogger(__name__)
+
+
+class IngestJob:
+    """
+    后台入库任务的状态，保存在 Redis 哈希 ragjob:{id} 中，任一 worker 都可以查询。
+
+    status 依次为 queued -> running -> done / failed，
+    进度计数（files_parsed / chunks_embedded / chunks_written 等）来自 IngestPipeline.stats。
+    每次写入都会刷新 updated_at，执行中的任务由 keepalive 定期刷新；worker 退出后
+    updated_at 不再变化，超过 stale_after 秒的未完成任务在查询时报告为 failed。
+    """
+
+    def __init__(
+        self,
+        client: redis.Redis,
+        job_id: str = None,
+        expire: int = 3600 * 24 * 7,
+        flush_interval: float = 1.0,
+    ):
+        """
+        :param client: Redis 客户端
+        :param job_id: 任务 ID，为空时生成新 ID
+        :param expire: 任务状态的保留时间，单位为秒
+        :param flush_interval: 进度写入 Redis 的最小间隔，单位为秒
+        """
+        self.client = client
+        self.job_id = job_id or uuid.uuid4().hex
+        self.key = f"ragjob:{self.job_id}"
+        self.expire = expire
+        self.flush_interval = flush_interval
+        self.stats = {}
+        self._flushed_at = 0.0
+        self._flushing = None
+        self._finished = False
+        self._lock = threading.Lock()
+
+    def _update(self, **fields):
+        fields["updated_at"] = time.time()
+        pipe = self.client.pipeline(transaction=False)
+        pipe.hset(self.key, mapping={k: json.dumps(v) for k, v in fields.items()})
+        pipe.expire(self.key, self.expire)
+        pipe.execute()
+
+    def create(self, index_name: str, files: list):
+        self._update(
+            job_id=self.job_id,
+            index=index_name,
+            files=files,
+            status="queued",
+            created_at=time.time(),
+        )
+
+    def start(self):
+        self._update(status="running", started_at=time.time())
+
+    def progress(self, stats: dict):
+        """
+        IngestPipeline 的进度回调，按 flush_interval 节流写入。
+        在事件循环中调用时写入放到线程池中执行，同一时间最多一次写入，不阻塞事件循环。
+        """
+        self.stats = stats
+        now = time.monotonic()
+        if now - self._flushed_at < self.flush_interval:
+            return
+        try:
+            loop = asyncio.get_running_loop()
+        except RuntimeError:
+            loop = None
+        if loop is None:
+            self._flushed_at = now
+            self._flush(stats)
+        elif self._flushing is None or self._flushing.done():
+            self._flushed_at = now
+            self._flushing = loop.run_in_executor(None, self._flush, stats)
+
+    def _flush(self, stats: dict):
+        with self._lock:
+            # finish 之后到达的进度写入会覆盖最终计数，直接丢弃
+            if self._finished:
+                return
+            try:
+                self._update(stats=stats)
+            except Exception as e:
+                log.error(f"Error updating ingest job {self.job_id}: {e}")
+
+    def heartbeat(self):
+        with self._lock:
+            if not self._finished:
+                self._update()
+
+    async def keepalive(self, interval: float = 15):
+        """每 interval 秒刷新一次 updated_at，直到被取消。"""
+        while True:
+            await asyncio.sleep(interval)
+            try:
+                await asyncio.to_thread(self.heartbeat)
+            except Exception as e:
+                log.error(f"Error updating ingest job {self.job_id}: {e}")
+
+    def finish(self, error: str = None):
+        with self._lock:
+            self._finished = True
+            self._update(
+                status="failed" if error else "done",
+                stats=self.stats,
+                error=error,
+                finished_at=time.time(),
+            )
+
+    @staticmethod
+    def get(client: redis.Redis, job_id: str, stale_after: float = 120) -> Optional[dict]:
+        """
+        读取任务状态，任务不存在或已过期时返回 None。
+        未完成且超过 stale_after 秒没有刷新的任务视为 worker 已退出，报告为 failed。
+        """
+        data = client.hgetall(f"ragjob:{job_id}")
+        if not data:
+            return None
+        job = {
+            (k.decode() if isinstance(k, bytes) else k): json.loads(v)
+            for k, v in data.items()
+        }
+        updated_at = job.get("updated_at") or job.get("created_at") or 0
+        if job.get("status") in ("queued", "running") and time.time() - updated_at > stale_after:
+            job["status"] = "failed"
+            job["error"] = f"Ingest worker stopped responding, no update for {int(time.time() - updated_at)}s"
+        return job
@@ -0,0 +1,72 @@
+import hashlib
+import json
+from typing import Optional
+
+from common.rediscache import CacheNamespace
+
+
+def llm_cache_key(kind: str, **request) -> str:
+    """
+    请求的规范化哈希：参数按键排序后序列化，字节相同的请求得到相同的键。
+
+    Args:
+        kind (str): 请求类型，如 text / json。
+        **request: sysmsg、prompt、model、temperature、schema 等请求参数。
+
+    Returns:
+        str: 缓存键。
+    """
+    canonical = json.dumps(
+        request, sort_keys=True, ensure_ascii=False, separators=(",", ":")
+    )
+    return f"{kind}:{hashlib.sha256(canonical.encode()).hexdigest()}"
+
+
+def llm_cache_enabled(temperature: Optional[float], header: Optional[str] = None) -> bool:
+    """
+    是否使用响应缓存：请求头 X-LLM-Cache 显式开启或关闭，未指定时只缓存 temperature 为 0 的请求。
+    """
+    if header is not None:
+        return header.strip().lower() in ["1", "true", "yes", "on"]
+    return temperature == 0
+
+
+class LLMResponseCache:
+    """
+    LLM 响应的精确匹配缓存，保存在 llm 缓存命名空间中（过期时间见 NAMESPACE_TTLS / CACHE_TTL_LLM），
+    缓存值包含响应内容和首次生成时的 token 用量。
+    """
+
+    def __init__(self, namespace: CacheNamespace, max_bytes: int = 256 * 1024):
+        """
+        :param namespace: 缓存命名空间
+        :param max_bytes: 单条响应的最大字节数，超过则不缓存
+        """
+        self.namespace = namespace
+        self.max_bytes = max_bytes
+        self.counters = {"hits": 0, "misses": 0, "skipped": 0, "tokens_saved": 0}
+
+    async def get(self, key: str) -> Optional[dict]:
+        """
+        :return: {"content", "usage"}，未命中返回 None
+        """
+        value = await self.namespace.get(key)
+        if value is None:
+            self.counters["misses"] += 1
+            return None
+        self.counters["hits"] += 1
+        self.counters["tokens_saved"] += (value.get("usage") or {}).get("total_tokens", 0)
+        return value
+
+    async def set(self, key: str, content: str, usage: dict = None) -> bool:
+        if content is None or len(content.encode("utf-8")) > self.max_bytes:
+            self.counters["skipped"] += 1
+            return False
+        return await self.namespace.set(key, {"content": content, "usage": usage})
+
+    def stats(self) -> dict:
+        total = self.counters["hits"] + self.counters["misses"]
+        return dict(
+            self.counters,
+            hit_ratio=round(self.counters["hits"] / total, 4) if total else 0.0,
+        )
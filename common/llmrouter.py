@@ -0,0 +1,266 @@
+import asyncio
+import json
+import logging
+import os
+import random
+import time
+from typing import Dict, List, Optional
+
+import openai
+from openai import AsyncAzureOpenAI
+
+from common.aoaiclient import openai_clients
+
+log = logging.getLogger(__name__)
+
+# 可以换一个部署重试的错误：429、5xx、连接失败和超时
+FAILOVER_ERRORS = (
+    openai.RateLimitError,
+    openai.InternalServerError,
+    openai.APIConnectionError,
+)
+
+
+class Deployment:
+    """
+    一个 Azure OpenAI 部署及其运行状态：延迟（EWMA）、剩余配额（x-ratelimit-* 响应头）和摘除时间。
+    """
+
+    def __init__(
+        self,
+        endpoint: str,
+        deployment: str,
+        api_key: str,
+        api_version: str,
+        weight: float = 1.0,
+    ):
+        if not weight > 0:
+            raise ValueError(f"Deployment {endpoint}/{deployment} weight must be > 0, got {weight}")
+        self.endpoint = endpoint
+        self.deployment = deployment
+        self.api_key = api_key
+        self.api_version = api_version
+        self.weight = weight
+        self.latency = None
+        self.remaining_requests = None
+        self.remaining_tokens = None
+        self.failures = 0
+        self.ejected_until = 0.0
+        self.counters = {"requests": 0, "errors": 0, "failovers": 0}
+
+    @property
+    def name(self) -> str:
+        return f"{self.endpoint}/{self.deployment}"
+
+    @property
+    def client(self) -> AsyncAzureOpenAI:
+        """共享连接池上的客户端，关闭 SDK 自带的重试，由路由器负责故障转移和退避重试。"""
+        return openai_clients.get_async(
+            endpoint=self.endpoint,
+            deployment=self.deployment,
+            api_key=self.api_key,
+            api_version=self.api_version,
+            max_retries=0,
+        )
+
+    def healthy(self, now: float) -> bool:
+        return self.ejected_until <= now
+
+    def score(self, quota_watermark: int) -> float:
+        """选择权重：配置权重 × 剩余配额系数 ÷ 延迟。"""
+        score = self.weight
+        if self.remaining_tokens is not None:
+            score *= max(min(self.remaining_tokens / quota_watermark, 1.0), 0.01)
+        if self.remaining_requests is not None and self.remaining_requests <= 0:
+            score *= 0.01
+        if self.latency is not None:
+            score /= max(self.latency, 0.05)
+        return score
+
+    def record_success(self, latency: float, headers):
+        self.latency = latency if self.latency is None else 0.8 * self.latency + 0.2 * latency
+        for name, attr in (
+            ("x-ratelimit-remaining-tokens", "remaining_tokens"),
+            ("x-ratelimit-remaining-requests", "remaining_requests"),
+        ):
+            value = headers.get(name)
+            if value is not None:
+                try:
+                    setattr(self, attr, int(float(value)))
+                except ValueError:
+                    pass
+        self.failures = 0
+
+    def record_failure(self, error: Exception, max_cooldown: float):
+        """摘除部署：429 按 Retry-After，其他错误按连续失败次数指数退避。"""
+        self.failures += 1
+        self.counters["errors"] += 1
+        retry_after = None
+        response = getattr(error, "response", None)
+        if response is not None:
+            retry_after = response.headers.get("retry-after")
+        try:
+            cooldown = float(retry_after) if retry_after else 2.0 ** self.failures
+        except ValueError:
+            cooldown = 2.0 ** self.failures
+        self.ejected_until = time.monotonic() + min(cooldown, max_cooldown)
+        log.warning(f"deployment {self.name} ejected for {min(cooldown, max_cooldown):.1f}s: {error}")
+
+    def stats(self) -> dict:
+        return dict(
+            self.counters,
+            weight=self.weight,
+            latency=round(self.latency, 4) if self.latency is not None else None,
+            remaining_tokens=self.remaining_tokens,
+            remaining_requests=self.remaining_requests,
+            ejected=not self.healthy(time.monotonic()),
+        )
+
+
+class LLMRouter:
+    """
+    按模型名在多个部署之间路由 chat completion 请求。
+
+    按 权重 × 剩余配额 ÷ 延迟 加权随机选择健康的部署，遇到 429 / 5xx / 连接错误时
+    摘除该部署一段时间并换下一个部署重试；全部部署都被摘除时选择最早恢复的那个。
+    所有部署都试过仍失败时（例如只有一个部署），按 Retry-After 或指数退避等待后
+    再重试，最多 max_retries 轮，代替 SDK 自带的重试。
+    """
+
+    def __init__(
+        self,
+        deployments: Dict[str, List[Deployment]],
+        default: List[Deployment],
+        quota_watermark: int = 20000,
+        max_cooldown: float = 300,
+        max_retries: int = 2,
+        max_retry_wait: float = 20,
+    ):
+        """
+        :param deployments: 模型名到部署列表的映射
+        :param default: 未配置的模型使用的部署列表
+        :param quota_watermark: 剩余 token 低于该值时按比例降低选择权重
+        :param max_cooldown: 最长摘除时间，单位为秒
+        :param max_retries: 所有部署都失败后再重试的轮数
+        :param max_retry_wait: 每轮重试前的最长等待时间，单位为秒
+        """
+        self.deployments = deployments
+        self.default = default
+        self.quota_watermark = quota_watermark
+        self.max_cooldown = max_cooldown
+        self.max_retries = max_retries
+        self.max_retry_wait = max_retry_wait
+
+    def targets(self, model: str) -> List[Deployment]:
+        return self.deployments.get(model) or self.default
+
+    def pick(self, model: str, exclude: List[Deployment] = ()) -> Optional[Deployment]:
+        candidates = [d for d in self.targets(model) if d not in exclude]
+        if not candidates:
+            return None
+        now = time.monotonic()
+        healthy = [d for d in candidates if d.healthy(now)]
+        if not healthy:
+            return min(candidates, key=lambda d: d.ejected_until)
+        scores = [d.score(self.quota_watermark) for d in healthy]
+        return random.choices(healthy, weights=scores)[0]
+
+    def _retry_wait(self, error: Exception, retry: int) -> float:
+        """重试前的等待时间：优先使用 Retry-After，否则 0.5s 起指数退避并加抖动。"""
+        response = getattr(error, "response", None)
+        retry_after = response.headers.get("retry-after") if response is not None else None
+        try:
+            wait = float(retry_after) if retry_after else 0.5 * 2 ** (retry - 1)
+        except ValueError:
+            wait = 0.5 * 2 ** (retry - 1)
+        return min(wait + random.uniform(0, wait / 4), self.max_retry_wait)
+
+    async def create(
+        self, exclude: List[Deployment] = (), attempts: List[Deployment] = None, **params
+    ):
+        """
+        调用 chat.completions.create，失败时故障转移到其他部署。
+        stream=True 时返回流对象，只在建立连接阶段故障转移。
+
+        Args:
+            exclude (List[Deployment], optional): 不使用的部署。
+            attempts (List[Deployment], optional): 依次使用的部署会追加到该列表，供对冲请求避开。
+            **params: chat.completions.create 的参数，model 决定可用的部署。
+
+        Returns:
+            ChatCompletion 或 AsyncStream。
+        """
+        tried, last_error, retries = list(exclude), None, 0
+        while True:
+            target = self.pick(params.get("model"), tried)
+            if target is None:
+                if last_error is None:
+                    raise ValueError(f"No deployment available for model {params.get('model')}")
+                if retries >= self.max_retries:
+                    raise last_error
+                retries += 1
+                await asyncio.sleep(self._retry_wait(last_error, retries))
+                tried = list(exclude)
+                continue
+            tried.append(target)
+            if attempts is not None:
+                attempts.append(target)
+            target.counters["requests"] += 1
+            start = time.monotonic()
+            try:
+                raw = await target.client.chat.completions.with_raw_response.create(**params)
+            except FAILOVER_ERRORS as e:
+                target.record_failure(e, self.max_cooldown)
+                target.counters["failovers"] += 1
+                last_error = e
+                continue
+            target.record_success(time.monotonic() - start, raw.headers)
+            return raw.parse()
+
+    def stats(self) -> dict:
+        result = {}
+        for model, targets in list(self.deployments.items()) + [("default", self.default)]:
+            result[model] = {d.name: d.stats() for d in targets}
+        return result
+
+
+def _deployment_from_config(item: dict) -> Deployment:
+    return Deployment(
+        endpoint=item["endpoint"],
+        deployment=item["deployment"],
+        api_key=item.get("api_key") or os.getenv(item.get("api_key_env", "AZURE_OPENAI_API_KEY")),
+        api_version=item.get("api_version") or os.getenv("AZURE_OPENAI_API_VERSION"),
+        weight=float(item.get("weight", 1.0)),
+    )
+
+
+def load_llm_router() -> LLMRouter:
+    """
+    从环境变量创建路由器。AZURE_OPENAI_DEPLOYMENTS 为 JSON，例如
+    {"gpt-4o": [{"endpoint": "...", "deployment": "gpt-4o", "api_key_env": "EASTUS_KEY", "weight": 2}]}；
+    未配置的模型使用 AZURE_OPENAI_ENDPOINT / AZURE_OPENAI_MODEL_DEPLOYMENT_NAME。
+    """
+    config = json.loads(os.environ.get("AZURE_OPENAI_DEPLOYMENTS") or "{}")
+    deployments = {
+        model: [_deployment_from_config(item) for item in items]
+        for model, items in config.items()
+    }
+    default = [
+        Deployment(
+            endpoint=os.getenv("AZURE_OPENAI_ENDPOINT"),
+            deployment=os.getenv("AZURE_OPENAI_MODEL_DEPLOYMENT_NAME"),
+            api_key=os.getenv("AZURE_OPENAI_API_KEY"),
+            api_version=os.getenv("AZURE_OPENAI_API_VERSION"),
+        )
+    ]
+    return LLMRouter(
+        deployments,
+        default,
+        quota_watermark=int(os.environ.get("LLM_ROUTER_QUOTA_WATERMARK", 20000)),
+        max_cooldown=float(os.environ.get("LLM_ROUTER_MAX_COOLDOWN", 300)),
+        max_retries=int(os.environ.get("LLM_ROUTER_MAX_RETRIES", 2)),
+        max_retry_wait=float(os.environ.get("LLM_ROUTER_MAX_RETRY_WAIT", 20)),
+    )
+
+
+llm_router = load_llm_router()
@@ -0,0 +1,289 @@
+import asyncio
+import fcntl
+import json
+import logging
+import os
+import shutil
+import threading
+import time
+import uuid
+from typing import Callable, Dict, List, Optional, Tuple
+
+import numpy as np
+import redis
+from langchain_core.documents import Document
+
+from common.indexconfig import IndexConfig, index_key_prefix
+from common.utils import get_global_datadir
+
+log = logging.getLogger(__name__)
+
+
+def _decode(value):
+    if isinstance(value, bytes):
+        try:
+            return value.decode("utf-8")
+        except UnicodeDecodeError:
+            return None
+    return value
+
+
+class LocalIndex:
+    """
+    热点索引的进程内向量检索后端。
+
+    索引的向量快照以 .npy 文件保存在 DATA_DIR/localindex/{index} 下，
+    通过 np.load(mmap_mode="r") 打开，多个 uvicorn worker 共享同一份页缓存。
+    manifest.json 指向当前版本，刷新时只从 Redis 拉取新增的文档键，
+    删除已不存在的文档，然后原子替换 manifest。
+    文档键由内容和元数据的指纹派生，相同的键对应相同的内容，刷新只需比较键的增减；
+    索引配置的 revision 变化（删除后重建、元数据字段或向量类型变化）时整体重建快照。
+    """
+
+    def __init__(
+        self,
+        index_name: str,
+        key_prefix: str = None,
+        refresh_interval: int = 300,
+        content_key: str = "content",
+        vector_key: str = "content_vector",
+    ):
+        """
+        :param index_name: 索引名称
+        :param key_prefix: Redis 文档键前缀，默认为 doc:{index_name}
+        :param refresh_interval: 自动刷新间隔，单位为秒
+        :param content_key: 文本字段名
+        :param vector_key: 向量字段名
+        """
+        self.index_name = index_name
+        self.key_prefix = key_prefix or f"doc:{index_name}"
+        self.refresh_interval = refresh_interval
+        self.content_key = content_key
+        self.vector_key = vector_key
+        self.datadir = get_global_datadir(os.path.join("localindex", index_name))
+        self.manifest_file = os.path.join(self.datadir, "manifest.json")
+        self._lock = threading.Lock()
+        self._manifest_mtime = None
+        self._version = None
+        self._vectors: Optional[np.ndarray] = None
+        self._docs: List[Dict] = []
+        self._refresh_task: Optional[asyncio.Task] = None
+
+    def _read_manifest(self) -> Optional[dict]:
+        try:
+            with open(self.manifest_file) as f:
+                return json.load(f)
+        except FileNotFoundError:
+            return None
+
+    def _load(self):
+        """manifest 变化时（可能由其他 worker 刷新）重新映射快照文件。"""
+        try:
+            mtime = os.stat(self.manifest_file).st_mtime_ns
+        except FileNotFoundError:
+            return
+        if mtime == self._manifest_mtime:
+            return
+        manifest = self._read_manifest()
+        version = manifest["version"]
+        if version != self._version:
+            try:
+                vectors = np.load(os.path.join(self.datadir, f"{version}.npy"), mmap_mode="r")
+                with open(os.path.join(self.datadir, f"{version}.json"), encoding="utf-8") as f:
+                    docs = json.load(f)
+            except FileNotFoundError:
+                # 读取期间被另一个 worker 的刷新替换，下次查询再加载
+                return
+            with self._lock:
+                self._vectors, self._docs, self._version = vectors, docs, version
+        self._manifest_mtime = mtime
+
+    @property
+    def ready(self) -> bool:
+        self._load()
+        return self._vectors is not None
+
+    def is_stale(self) -> bool:
+        try:
+            mtime = os.stat(self.manifest_file).st_mtime
+        except FileNotFoundError:
+            return True
+        return time.time() - mtime > self.refresh_interval
+
+    def schedule_refresh(self, client: redis.Redis, decode: Callable[[bytes], np.ndarray] = None):
+        """快照过期时在后台线程中刷新，不阻塞当前查询。"""
+        if self._refresh_task is not None and not self._refresh_task.done():
+            return
+        if not self.is_stale():
+            return
+        self._refresh_task = asyncio.create_task(
+            asyncio.to_thread(self.refresh, client, decode=decode)
+        )
+        self._refresh_task.add_done_callback(self._on_refreshed)
+
+    def _on_refreshed(self, task: asyncio.Task):
+        if not task.cancelled() and task.exception():
+            log.error(f"local index {self.index_name} refresh failed: {task.exception()}")
+
+    def _fetch(self, client: redis.Redis, keys: List[str], batch_size: int, decode):
+        docs, vectors = [], []
+        for i in range(0, len(keys), batch_size):
+            part = keys[i : i + batch_size]
+            pipe = client.pipeline(transaction=False)
+            for key in part:
+                pipe.hgetall(key)
+            for key, fields in zip(part, pipe.execute()):
+                vector = fields.pop(self.vector_key.encode(), None)
+                if vector is None:
+                    continue
+                content = _decode(fields.pop(self.content_key.encode(), b""))
+                metadata = {"id": key}
+                for name, value in fields.items():
+                    value = _decode(value)
+                    if value is not None:
+                        metadata[_decode(name)] = value
+                docs.append({"id": key, "content": content, "metadata": metadata})
+                vectors.append(decode(vector))
+        return docs, vectors
+
+    def refresh(
+        self,
+        client: redis.Redis,
+        batch_size: int = 500,
+        decode: Callable[[bytes], np.ndarray] = None,
+    ) -> bool:
+        """
+        从 Redis 增量刷新快照，索引配置的 revision 与快照记录的不一致时重新拉取全部文档。
+        同一时间只有一个 worker 执行刷新。
+
+        Args:
+            client (redis.Redis): Redis 客户端。
+            batch_size (int, optional): 每批 HGETALL 的键数量。
+            decode (callable, optional): 向量字节解码函数，默认按 float32 解码。
+
+        Returns:
+            bool: 是否执行了刷新。
+        """
+        with open(os.path.join(self.datadir, "refresh.lock"), "w") as lockfile:
+            try:
+                fcntl.flock(lockfile, fcntl.LOCK_EX | fcntl.LOCK_NB)
+            except BlockingIOError:
+                return False
+            self._load()
+            old_manifest = self._read_manifest()
+            revision = IndexConfig.load(client, self.index_name, ttl=0).revision
+            rebuild = old_manifest is not None and old_manifest.get("config_revision") != revision
+            current_ids = [] if rebuild else [d["id"] for d in self._docs]
+            keys = {
+                _decode(k)
+                for k in client.scan_iter(match=f"{self.key_prefix}:*", count=batch_size)
+            }
+            keep = [i for i, doc_id in enumerate(current_ids) if doc_id in keys]
+            added = sorted(keys - set(current_ids))
+            if len(keep) == len(current_ids) and not added and old_manifest and not rebuild:
+                os.utime(self.manifest_file)
+                return True
+
+            decode = decode or (lambda b: np.frombuffer(b, dtype=np.float32))
+            new_docs, new_vectors = self._fetch(client, added, batch_size, decode)
+            parts = []
+            if keep:
+                parts.append(np.asarray(self._vectors[keep], dtype=np.float32))
+            if new_vectors:
+                matrix = np.vstack(new_vectors)
+                norms = np.linalg.norm(matrix, axis=1, keepdims=True)
+                parts.append(matrix / np.where(norms == 0, 1, norms))
+            vectors = np.vstack(parts) if parts else np.zeros((0, 0), dtype=np.float32)
+            docs = [self._docs[i] for i in keep] + new_docs
+
+            version = uuid.uuid4().hex
+            np.save(os.path.join(self.datadir, f"{version}.npy"), vectors.astype(np.float32))
+            with open(os.path.join(self.datadir, f"{version}.json"), "w", encoding="utf-8") as f:
+                json.dump(docs, f, ensure_ascii=False)
+            self._write_manifest(
+                {
+                    "version": version,
+                    "config_revision": revision,
+                    "count": len(docs),
+                    "updated_at": time.time(),
+                }
+            )
+            if old_manifest:
+                # 其他 worker 已映射的旧文件在 Linux 上删除后仍可继续读取
+                for ext in ("npy", "json"):
+                    path = os.path.join(self.datadir, f"{old_manifest['version']}.{ext}")
+                    if os.path.exists(path):
+                        os.remove(path)
+            log.info(
+                f"local index {self.index_name} {'rebuilt' if rebuild else 'refreshed'}: "
+                f"+{len(new_docs)} -{len(current_ids) - len(keep)} total {len(docs)}"
+            )
+        self._load()
+        return True
+
+    def _write_manifest(self, manifest: dict):
+        tmpfile = f"{self.manifest_file}.{uuid.uuid4().hex}.tmp"
+        with open(tmpfile, "w") as f:
+            json.dump(manifest, f)
+        os.replace(tmpfile, self.manifest_file)
+
+    def search_by_vector(self, vector: List[float], k: int = 4) -> List[Tuple[Document, float]]:
+        """
+        向量化的精确余弦 KNN 检索。
+
+        Args:
+            vector (List[float]): 查询向量。
+            k (int, optional): 返回条数。
+
+        Returns:
+            List[Tuple[Document, float]]: (文档, 余弦相似度) 列表，按相似度降序。
+        """
+        self._load()
+        with self._lock:
+            vectors, docs = self._vectors, self._docs
+        if vectors is None or not len(docs):
+            return []
+        query = np.asarray(vector, dtype=np.float32)
+        query /= np.linalg.norm(query) or 1.0
+        scores = vectors @ query
+        k = min(k, len(docs))
+        top = np.argpartition(-scores, k - 1)[:k]
+        top = top[np.argsort(-scores[top])]
+        return [
+            (
+                Document(page_content=docs[i]["content"], metadata=docs[i]["metadata"]),
+                float(scores[i]),
+            )
+            for i in top
+        ]
+
+
+_local_indexes: Dict[str, LocalIndex] = {}
+
+
+def get_local_index(index_name: str, physical_name: str = None) -> Optional[LocalIndex]:
+    """
+    返回启用了本地检索的索引实例，启用列表由环境变量 LOCAL_INDEXES（逗号分隔）配置。
+
+    Args:
+        index_name (str): 逻辑索引名称，用于判断是否启用。
+        physical_name (str, optional): 别名当前指向的物理索引，快照按物理索引保存。
+    """
+    enabled = [i.strip() for i in os.environ.get("LOCAL_INDEXES", "").split(",") if i.strip()]
+    if index_name not in enabled:
+        return None
+    physical_name = physical_name or index_name
+    if physical_name not in _local_indexes:
+        _local_indexes[physical_name] = LocalIndex(
+            physical_name,
+            key_prefix=index_key_prefix(physical_name),
+            refresh_interval=int(os.environ.get("LOCAL_INDEX_REFRESH", 300)),
+        )
+    return _local_indexes[physical_name]
+
+
+def release_local_index(physical_name: str):
+    """物理索引被回收后释放其快照映射并删除快照文件。"""
+    local = _local_indexes.pop(physical_name, None)
+    if local is not None:
+        shutil.rmtree(local.datadir, ignore_errors=True)
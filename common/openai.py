@@ -6,45 +6,89 @@ import aiohttp
 from openai import AsyncAzureOpenAI
 import os
 
+from common.aoaiclient import openai_clients
 from common.azure_blob import generate_blob_rl_sas_url, upload_blobfile
+from common.hedging import load_hedge_policy
+from common.llmcache import llm_cache_key
+from common.llmrouter import llm_router
+from common.singleflight import SingleFlight
 
 log = logging.getLogger(__name__)
 
+llm_singleflight = SingleFlight()
+llm_hedge = load_hedge_policy()
 
-def get_openai_client():
-    return AsyncAzureOpenAI(
-        azure_endpoint=os.getenv("AZURE_OPENAI_ENDPOINT"),
-        azure_deployment=os.getenv("AZURE_OPENAI_MODEL_DEPLOYMENT_NAME"),
+
+def get_openai_client() -> AsyncAzureOpenAI:
+    return openai_clients.get_async(
+        endpoint=os.getenv("AZURE_OPENAI_ENDPOINT"),
+        deployment=os.getenv("AZURE_OPENAI_MODEL_DEPLOYMENT_NAME"),
         api_key=os.getenv("AZURE_OPENAI_API_KEY"),
         api_version=os.getenv("AZURE_OPENAI_API_VERSION"),
     )
 
-def get_openai_imagine_client():
-    return AsyncAzureOpenAI(
-        azure_endpoint=os.getenv("IMAGINE_AZURE_OPENAI_ENDPOINT"),
-        azure_deployment=os.getenv("IMAGINE_AZURE_OPENAI_MODEL_DEPLOYMENT_NAME"),
+def get_openai_imagine_client() -> AsyncAzureOpenAI:
+    return openai_clients.get_async(
+        endpoint=os.getenv("IMAGINE_AZURE_OPENAI_ENDPOINT"),
+        deployment=os.getenv("IMAGINE_AZURE_OPENAI_MODEL_DEPLOYMENT_NAME"),
         api_key=os.getenv("IMAGINE_AZURE_OPENAI_API_KEY"),
         api_version=os.getenv("IMAGINE_AZURE_OPENAI_API_VERSION"),
     )
 
-async def openai_async_text_generate(sysmsg, prompt, model: str, temperature: float = 0.7, streaming: bool = False) -> str:
-    """OpenAI API"""
-    client = get_openai_client()
+def completion_usage(response) -> dict:
+    """token 用量，附带首个 choice 的 finish_reason，调用方据此判断输出是否完整。"""
+    usage = response.usage.model_dump() if getattr(response, "usage", None) else {}
+    if response.choices:
+        usage["finish_reason"] = response.choices[0].finish_reason
+    return usage
+
+
+async def chat_completion(route: str = "text", **params):
+    """
+    非流式 chat completion，返回 (内容, token 用量)。经 llm_router 在多个部署间路由，
+    并发的相同请求（LLM_SINGLEFLIGHT 开启时）合并为一次上游调用，
+    route 在 LLM_HEDGE_ROUTES 中时慢请求会被对冲到另一个部署（只有一个部署时发往同一部署）。
+    """
+    async def create():
+        attempts = []
+
+        async def primary():
+            return await llm_router.create(stream=False, attempts=attempts, **params)
+
+        async def hedge():
+            others = len(llm_router.targets(params.get("model"))) > len(attempts)
+            return await llm_router.create(stream=False, exclude=attempts if others else (), **params)
+
+        response = await llm_hedge.run(route, primary, hedge, model=params.get("model"))
+        return response.choices[0].message.content, completion_usage(response)
+
+    if os.environ.get("LLM_SINGLEFLIGHT", "1") not in ["1", "true"]:
+        return await create()
+    return await llm_singleflight.do(llm_cache_key("chat", **params), create)
+
+
+async def openai_async_text_generate(
+    sysmsg, prompt, model: str, temperature: float = 0.7, streaming: bool = False, with_usage: bool = False
+) -> str:
+    """OpenAI API, with_usage=True 时返回 (内容, token 用量)"""
     messages = [
         {"role": "system", "content": sysmsg},
         {"role": "user", "content": prompt},
     ]
-    response = await client.chat.completions.create(
-        model=model, messages=messages, stream=streaming, temperature=temperature
+    if streaming:
+        return await llm_router.create(
+            model=model, messages=messages, stream=True, temperature=temperature
+        )
+    content, usage = await chat_completion(
+        model=model, messages=messages, temperature=temperature
     )
-    if not streaming:
-        return response.choices[0].message.content
-    return response
+    return (content, usage) if with_usage else content
 
 
-async def openai_async_json_generate(sysmsg, prompt, model: str, schema: dict = None) -> str:
-    """OpenAI API"""
-    client = get_openai_client()
+async def openai_async_json_generate(
+    sysmsg, prompt, model: str, schema: dict = None, temperature: float = None, with_usage: bool = False
+) -> str:
+    """OpenAI API, with_usage=True 时返回 (内容, token 用量)"""
     messages = [
         {"role": "system", "content": sysmsg},
         {"role": "user", "content": prompt},
@@ -56,18 +100,20 @@ async def openai_async_json_generate(sysmsg, prompt, model: str, schema: dict =
             "schema": schema,
         }
     }
-    response = await client.chat.completions.create(
+    kwargs = {"temperature": temperature} if temperature is not None else {}
+    content, usage = await chat_completion(
+        route="json",
         model=model,
         response_format=json_schema if schema else {"type": "json_object"},
         messages=messages,
-        stream=False
+        **kwargs
     )
-    return response.choices[0].message.content
+    return (content, usage) if with_usage else content
 
 
 async def openai_analyze_image(prompt_str, model, imageb64, **kwargs):
-    client = get_openai_client()
-    response = await client.chat.completions.create(
+    content, _ = await chat_completion(
+        route="image",
         model=model,
         messages=[
             {
@@ -87,7 +133,7 @@ async def openai_analyze_image(prompt_str, model, imageb64, **kwargs):
         max_tokens=2000,
         **kwargs
     )
-    return response.choices[0].message.content
+    return content
 
 
 async def openai_agenerate_image(
@@ -0,0 +1,253 @@
+import asyncio
+import hashlib
+import json
+import logging
+import os
+import re
+import weakref
+from typing import List, Tuple
+
+import asyncpg
+from langchain_core.documents import Document
+
+from common.indexconfig import FilterError, filter_values
+
+log = logging.getLogger(__name__)
+
+PG_INDEX_TYPES = ("hnsw", "ivfflat")
+# pgvector 的 HNSW / IVFFlat 索引最多支持 2000 维的 vector 列
+PG_MAX_INDEX_DIMENSIONS = 2000
+
+_pools = weakref.WeakKeyDictionary()
+
+
+async def get_pg_pool() -> asyncpg.Pool:
+    """
+    返回当前事件循环上的共享 asyncpg 连接池，连接串由 PGVECTOR_URL 配置。
+    asyncpg 连接池绑定事件循环，因此按循环分别创建。
+    """
+    loop = asyncio.get_running_loop()
+    pool = _pools.get(loop)
+    if pool is None:
+        pool = await asyncpg.create_pool(
+            os.environ["PGVECTOR_URL"],
+            min_size=int(os.environ.get("PGVECTOR_POOL_MIN", 1)),
+            max_size=int(os.environ.get("PGVECTOR_POOL_MAX", 10)),
+        )
+        _pools[loop] = pool
+    return pool
+
+
+async def close_pg_pool():
+    """关闭当前事件循环上的连接池，用于 asyncio.run 包装的一次性调用和应用关闭。"""
+    pool = _pools.pop(asyncio.get_running_loop(), None)
+    if pool is not None:
+        await pool.close()
+
+
+def _vector_literal(vector: List[float]) -> str:
+    return "[" + ",".join(str(float(v)) for v in vector) + "]"
+
+
+def _like_escape(value: str) -> str:
+    return re.sub(r"([\\%_])", r"\\\1", value)
+
+
+class PgVectorStore:
+    """
+    Postgres/pgvector 向量库，每个索引对应一张表 (id, content, metadata jsonb, embedding vector)。
+
+    向量检索使用余弦距离，近似索引可选 HNSW（m / ef_construction / ef_search）
+    或 IVFFlat（lists / probes），全文检索使用 simple 配置的 tsvector。
+    """
+
+    def __init__(self, index_name: str, options: dict = None, filter_fields: dict = None):
+        """
+        :param index_name: 物理索引名称
+        :param options: 索引选项，如 {"index_type": "hnsw", "m": 16, "ef_construction": 64}
+        :param filter_fields: 可过滤的元数据字段及类型（tag / numeric）
+        """
+        self.index_name = index_name
+        self.options = dict(options or {})
+        self.index_type = self.options.get("index_type", "hnsw").lower()
+        if self.index_type not in PG_INDEX_TYPES:
+            raise ValueError(f"Unsupported pgvector index type {self.index_type}, expected one of {PG_INDEX_TYPES}")
+        self.filter_fields = filter_fields or {}
+        slug = re.sub(r"\W", "_", index_name).lower()[:40]
+        digest = hashlib.md5(index_name.encode()).hexdigest()[:8]
+        self.table = f"rag_{slug}_{digest}"
+
+    async def ensure_table(self, dimensions: int):
+        """首次写入时创建表、向量索引和全文索引。维度超过 PG_MAX_INDEX_DIMENSIONS 时抛出 ValueError。"""
+        if dimensions > PG_MAX_INDEX_DIMENSIONS:
+            raise ValueError(
+                f"pgvector {self.index_type} indexes support at most {PG_MAX_INDEX_DIMENSIONS} "
+                f"dimensions, got {dimensions}"
+            )
+        if self.index_type == "hnsw":
+            index_sql = (
+                f'CREATE INDEX IF NOT EXISTS "{self.table}_vec" ON "{self.table}" '
+                f"USING hnsw (embedding vector_cosine_ops) "
+                f"WITH (m = {int(self.options.get('m', 16))}, "
+                f"ef_construction = {int(self.options.get('ef_construction', 64))})"
+            )
+        else:
+            index_sql = (
+                f'CREATE INDEX IF NOT EXISTS "{self.table}_vec" ON "{self.table}" '
+                f"USING ivfflat (embedding vector_cosine_ops) "
+                f"WITH (lists = {int(self.options.get('lists', 100))})"
+            )
+        pool = await get_pg_pool()
+        async with pool.acquire() as conn:
+            async with conn.transaction():
+                await conn.execute("CREATE EXTENSION IF NOT EXISTS vector")
+                await conn.execute(
+                    f'CREATE TABLE IF NOT EXISTS "{self.table}" ('
+                    f"id text PRIMARY KEY, content text NOT NULL, "
+                    f"metadata jsonb NOT NULL DEFAULT '{{}}', embedding vector({int(dimensions)}) NOT NULL)"
+                )
+                await conn.execute(index_sql)
+                await conn.execute(
+                    f'CREATE INDEX IF NOT EXISTS "{self.table}_tsv" ON "{self.table}" '
+                    f"USING gin (to_tsvector('simple', content))"
+                )
+
+    async def add(
+        self,
+        ids: List[str],
+        texts: List[str],
+        metadatas: List[dict],
+        vectors: List[List[float]],
+    ):
+        pool = await get_pg_pool()
+        async with pool.acquire() as conn:
+            await conn.executemany(
+                f'INSERT INTO "{self.table}" (id, content, metadata, embedding) '
+                f"VALUES ($1, $2, $3::jsonb, $4::vector) "
+                f"ON CONFLICT (id) DO UPDATE SET content = EXCLUDED.content, "
+                f"metadata = EXCLUDED.metadata, embedding = EXCLUDED.embedding",
+                [
+                    (i, t, json.dumps(m or {}, ensure_ascii=False), _vector_literal(v))
+                    for i, t, m, v in zip(ids, texts, metadatas, vectors)
+                ],
+            )
+
+    async def delete(self, ids: List[str]):
+        pool = await get_pg_pool()
+        async with pool.acquire() as conn:
+            await conn.execute(f'DELETE FROM "{self.table}" WHERE id = ANY($1::text[])', ids)
+
+    def _filter_clauses(self, filters: List[dict], args: list) -> List[str]:
+        """把类型化过滤条件转换为 jsonb 条件，字段名和取值均参数化。"""
+        clauses = []
+        for f in filters or []:
+            field, op = f["field"], f.get("op", "eq")
+            kind = self.filter_fields.get(field)
+            if kind is None:
+                raise FilterError(f"Field {field} is not indexed in {self.index_name}")
+            args.append(field)
+            name = f"metadata->>${len(args)}"
+            if op in ("eq", "in", "prefix"):
+                if kind != "tag":
+                    raise FilterError(f"Operator {op} requires a tag field, {field} is {kind}")
+                values = filter_values(f)
+                if op == "prefix":
+                    args.append([_like_escape(str(v)) + "%" for v in values])
+                    clauses.append(f"{name} LIKE ANY(${len(args)}::text[])")
+                else:
+                    args.append([str(v) for v in values])
+                    clauses.append(f"{name} = ANY(${len(args)}::text[])")
+            elif op == "range":
+                if kind != "numeric":
+                    raise FilterError(f"Operator range requires a numeric field, {field} is {kind}")
+                if f.get("min") is not None:
+                    args.append(float(f["min"]))
+                    clauses.append(f"({name})::float8 >= ${len(args)}")
+                if f.get("max") is not None:
+                    args.append(float(f["max"]))
+                    clauses.append(f"({name})::float8 <= ${len(args)}")
+            else:
+                raise FilterError(f"Unsupported filter operator {op}")
+        return clauses
+
+    @staticmethod
+    def _to_document(row) -> Document:
+        metadata = json.loads(row["metadata"]) if row["metadata"] else {}
+        metadata["id"] = row["id"]
+        return Document(page_content=row["content"], metadata=metadata)
+
+    async def search_by_vector(
+        self, vector: List[float], k: int = 4, filters: List[dict] = None
+    ) -> List[Tuple[Document, float]]:
+        """
+        余弦距离 KNN 检索，过滤条件在同一条 SQL 中执行。
+
+        Returns:
+            List[Tuple[Document, float]]: (文档, 余弦相似度) 列表。
+        """
+        args = [_vector_literal(vector), k]
+        clauses = self._filter_clauses(filters, args)
+        where = f"WHERE {' AND '.join(clauses)}" if clauses else ""
+        sql = (
+            f"SELECT id, content, metadata, 1 - (embedding <=> $1::vector) AS score "
+            f'FROM "{self.table}" {where} ORDER BY embedding <=> $1::vector LIMIT $2'
+        )
+        pool = await get_pg_pool()
+        async with pool.acquire() as conn:
+            async with conn.transaction():
+                if self.index_type == "hnsw" and self.options.get("ef_search"):
+                    await conn.execute(f"SET LOCAL hnsw.ef_search = {int(self.options['ef_search'])}")
+                elif self.index_type == "ivfflat" and self.options.get("probes"):
+                    await conn.execute(f"SET LOCAL ivfflat.probes = {int(self.options['probes'])}")
+                rows = await conn.fetch(sql, *args)
+        return [(self._to_document(row), float(row["score"])) for row in rows]
+
+    async def text_search(
+        self, query: str, k: int = 4, filters: List[dict] = None
+    ) -> List[Tuple[Document, float]]:
+        """全文检索，按词 OR 匹配，ts_rank_cd 排序。"""
+        terms = re.findall(r"\w+", query)
+        if not terms:
+            return []
+        args = [" | ".join(terms), k]
+        clauses = [
+            "to_tsvector('simple', content) @@ to_tsquery('simple', $1)",
+            *self._filter_clauses(filters, args),
+        ]
+        sql = (
+            f"SELECT id, content, metadata, "
+            f"ts_rank_cd(to_tsvector('simple', content), to_tsquery('simple', $1)) AS score "
+            f'FROM "{self.table}" WHERE {" AND ".join(clauses)} ORDER BY score DESC LIMIT $2'
+        )
+        pool = await get_pg_pool()
+        async with pool.acquire() as conn:
+            rows = await conn.fetch(sql, *args)
+        return [(self._to_document(row), float(row["score"])) for row in rows]
+
+    async def drop(self):
+        pool = await get_pg_pool()
+        async with pool.acquire() as conn:
+            await conn.execute(f'DROP TABLE IF EXISTS "{self.table}"')
+
+    def drop_sync(self):
+        """
+        在同步代码中删除表，使用一次性连接，不占用各事件循环上的连接池。
+        不能在事件循环中调用，协程中请使用 drop。
+        """
+        try:
+            asyncio.get_running_loop()
+        except RuntimeError:
+            pass
+        else:
+            raise RuntimeError(
+                "PgVectorStore.drop_sync cannot run inside an event loop, await drop() instead"
+            )
+
+        async def drop():
+            conn = await asyncpg.connect(os.environ["PGVECTOR_URL"])
+            try:
+                await conn.execute(f'DROP TABLE IF EXISTS "{self.table}"')
+            finally:
+                await conn.close()
+
+        asyncio.run(drop())
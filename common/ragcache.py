@@ -0,0 +1,130 @@
+import threading
+from collections import OrderedDict
+from typing import List, Optional
+
+import numpy as np
+
+from common.utils import md5hash
+from common.embedcache import normalize_query
+from common.indexconfig import index_results_key, result_grace_ttl
+
+
+def rag_cache_key(scope: str, query: str) -> str:
+    """检索结果缓存键，scope 包含索引、版本和检索参数。"""
+    return f"rag_{md5hash(scope + '|' + normalize_query(query))}"
+
+
+async def track_rag_result(client, version: str, full_key: str, ttl: int):
+    """
+    把结果缓存的完整键登记到所属索引版本下，索引版本更替或索引回收时
+    由 retire_index_results 让这些键提前过期。
+
+    Args:
+        client: redis.asyncio 客户端。
+        version (str): RedisRag.get_index_version 返回的 "物理索引:版本号"。
+        full_key (str): 结果缓存在 Redis 中的完整键名。
+        ttl (int): 登记集合的过期时间，与结果缓存一致。
+    """
+    index_name, number = version.rsplit(":", 1)
+    key = index_results_key(index_name, number)
+    async with client.pipeline(transaction=False) as pipe:
+        pipe.sadd(key, full_key)
+        pipe.expire(key, ttl)
+        pipe.get(f"ragver:{index_name}")
+        _, _, current = await pipe.execute()
+    if int(current or 0) != int(number):
+        # 检索期间索引版本已更替，登记集合已回收过，结果和集合都按宽限期过期
+        async with client.pipeline(transaction=False) as pipe:
+            pipe.expire(full_key, result_grace_ttl())
+            pipe.expire(key, result_grace_ttl())
+            await pipe.execute()
+
+
+class _ScopeEntries:
+    """
+    一个 scope 下的查询向量矩阵。容量按需倍增到 max_entries，写满后按环形缓冲区原地覆盖最旧的行，
+    查询时不必重新拼接矩阵。
+    """
+
+    def __init__(self, max_entries: int, dims: int):
+        self.max_entries = max_entries
+        self.vectors = np.zeros((min(16, max_entries), dims), dtype=np.float32)
+        self.keys: List[str] = []
+        self.next = 0
+
+    @property
+    def size(self) -> int:
+        return len(self.keys)
+
+    def append(self, vector: np.ndarray, key: str):
+        if self.size < self.max_entries:
+            if self.size == len(self.vectors):
+                grown = np.zeros((min(self.size * 2, self.max_entries), self.vectors.shape[1]), dtype=np.float32)
+                grown[: self.size] = self.vectors
+                self.vectors = grown
+            self.vectors[self.size] = vector
+            self.keys.append(key)
+            return
+        self.vectors[self.next] = vector
+        self.keys[self.next] = key
+        self.next = (self.next + 1) % self.max_entries
+
+
+class SemanticResultIndex:
+    """
+    检索结果缓存的语义层：按 scope 保存近期查询向量及其结果缓存键，
+    新查询与某个已缓存查询的余弦距离不超过阈值时复用其结果。
+
+    scope 中带有索引版本号，入库或删除索引后旧 scope 不再被查到，按 LRU 淘汰。
+    """
+
+    def __init__(self, max_scopes: int = 256, max_entries: int = 512):
+        """
+        :param max_scopes: 最多保留的 scope 数
+        :param max_entries: 每个 scope 最多保留的查询数
+        """
+        self.max_scopes = max_scopes
+        self.max_entries = max_entries
+        self._scopes = OrderedDict()
+        self._lock = threading.Lock()
+        self.counters = {"hits": 0, "misses": 0}
+
+    @staticmethod
+    def _normalize(vector: List[float]) -> np.ndarray:
+        array = np.asarray(vector, dtype=np.float32)
+        return array / (np.linalg.norm(array) or 1.0)
+
+    def lookup(self, scope: str, vector: List[float], max_distance: float) -> Optional[str]:
+        """
+        :return: 最相近且距离不超过 max_distance 的缓存键，没有则返回 None
+        """
+        query = self._normalize(vector)
+        key = None
+        with self._lock:
+            entries = self._scopes.get(scope)
+            if entries is not None and entries.size and entries.vectors.shape[1] == len(query):
+                self._scopes.move_to_end(scope)
+                scores = entries.vectors[: entries.size] @ query
+                best = int(np.argmax(scores))
+                if 1 - scores[best] <= max_distance:
+                    key = entries.keys[best]
+            self.counters["hits" if key else "misses"] += 1
+        return key
+
+    def add(self, scope: str, vector: List[float], key: str):
+        query = self._normalize(vector)
+        with self._lock:
+            entries = self._scopes.get(scope)
+            if entries is None or entries.vectors.shape[1] != len(query):
+                entries = self._scopes[scope] = _ScopeEntries(self.max_entries, len(query))
+            self._scopes.move_to_end(scope)
+            entries.append(query, key)
+            while len(self._scopes) > self.max_scopes:
+                self._scopes.popitem(last=False)
+
+    def stats(self) -> dict:
+        with self._lock:
+            return dict(self.counters, scopes=len(self._scopes))
+
+
+semantic_result_index = SemanticResultIndex()
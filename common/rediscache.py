@@ -1,27 +1,179 @@
 import redis
+import redis.asyncio as aioredis
+import asyncio
 import json
-from typing import Optional
+import logging
+import os
+import time
+import zlib
+from collections import OrderedDict
+from typing import Callable, Dict, List, Optional
+
+try:
+    import zstandard
+except ImportError:
+    zstandard = None
+
+log = logging.getLogger(__name__)
+
+# 各命名空间的默认过期时间（秒），可用环境变量 CACHE_TTL_{NAMESPACE} 覆盖
+NAMESPACE_TTLS = {
+    "rag": 3600 * 24 * 365,
+    "llm": 3600 * 24 * 7,
+    "embeddings": 3600 * 24 * 7,
+}
+
+
+def unlink_matching(
+    client: redis.Redis,
+    pattern: str,
+    batch_size: int = 500,
+    interval: float = 0.0,
+    keep: Optional[Callable[[bytes], bool]] = None,
+) -> int:
+    """
+    按模式增量删除键：SCAN 分批取键，每批在一个 pipeline 中 UNLINK，不阻塞 Redis。
+    :param keep: 返回 True 的键不删除
+    :return: 删除的键数量
+    """
+    deleted, batch = 0, []
+    for key in client.scan_iter(match=pattern, count=batch_size):
+        if keep is None or not keep(key):
+            batch.append(key)
+        if len(batch) >= batch_size:
+            deleted += _unlink_batch(client, batch)
+            batch = []
+            if interval:
+                time.sleep(interval)
+    if batch:
+        deleted += _unlink_batch(client, batch)
+    return deleted
+
+
+def _unlink_batch(client: redis.Redis, keys: list) -> int:
+    pipe = client.pipeline(transaction=False)
+    for i in range(0, len(keys), 100):
+        pipe.unlink(*keys[i : i + 100])
+    return sum(pipe.execute())
+
+
+async def aunlink_matching(
+    client: aioredis.Redis,
+    pattern: str,
+    batch_size: int = 500,
+    interval: float = 0.0,
+    keep: Optional[Callable[[bytes], bool]] = None,
+) -> int:
+    """unlink_matching 的异步版本"""
+    deleted, batch = 0, []
+    async for key in client.scan_iter(match=pattern, count=batch_size):
+        if keep is None or not keep(key):
+            batch.append(key)
+        if len(batch) >= batch_size:
+            deleted += await _aunlink_batch(client, batch)
+            batch = []
+            await asyncio.sleep(interval)
+    if batch:
+        deleted += await _aunlink_batch(client, batch)
+    return deleted
+
+
+async def _aunlink_batch(client: aioredis.Redis, keys: list) -> int:
+    async with client.pipeline(transaction=False) as pipe:
+        for i in range(0, len(keys), 100):
+            pipe.unlink(*keys[i : i + 100])
+        return sum(await pipe.execute())
+
+
+class CacheCodec:
+    """
+    二进制安全的缓存值编码：bytes 和 str 原样存储，其他值编码为 JSON，只编码一次。
+    超过 threshold 字节的值压缩存储（安装了 zstandard 时用 zstd，否则用 zlib），
+    压缩后不更小则保留原文。
+
+    编码格式为 MAGIC + 类型 + 压缩方式 + 数据，不带 MAGIC 的值按旧格式（JSON）解码。
+    无法解码的值（如未安装 zstandard 的进程读到 zstd 压缩的值）抛出 ValueError，缓存按未命中处理。
+    """
+
+    MAGIC = b"\xc1"
+    KIND_BYTES, KIND_STR, KIND_JSON = b"b", b"s", b"j"
+    RAW, ZLIB, ZSTD = b"0", b"z", b"Z"
+
+    def __init__(self, threshold: int = 1024, level: int = 3):
+        """
+        :param threshold: 压缩阈值，单位为字节
+        :param level: 压缩级别
+        """
+        self.threshold = threshold
+        self.level = level
+        self.counters = {"bytes_raw": 0, "bytes_stored": 0}
+
+    def encode(self, value) -> bytes:
+        if isinstance(value, bytes):
+            kind, payload = self.KIND_BYTES, value
+        elif isinstance(value, str):
+            kind, payload = self.KIND_STR, value.encode("utf-8")
+        else:
+            kind, payload = self.KIND_JSON, json.dumps(value, ensure_ascii=False).encode("utf-8")
+        method = self.RAW
+        if len(payload) >= self.threshold:
+            if zstandard is not None:
+                compressed, method_used = zstandard.ZstdCompressor(level=self.level).compress(payload), self.ZSTD
+            else:
+                compressed, method_used = zlib.compress(payload, self.level), self.ZLIB
+            if len(compressed) < len(payload):
+                self.counters["bytes_raw"] += len(payload)
+                self.counters["bytes_stored"] += len(compressed)
+                payload, method = compressed, method_used
+        return self.MAGIC + kind + method + payload
+
+    def decode(self, data: bytes):
+        if data is None:
+            return None
+        if not data.startswith(self.MAGIC):
+            return json.loads(data)
+        kind, method, payload = data[1:2], data[2:3], data[3:]
+        if method == self.ZSTD:
+            if zstandard is None:
+                raise ValueError("Cache value is zstd-compressed but zstandard is not installed")
+            payload = zstandard.ZstdDecompressor().decompress(payload)
+        elif method == self.ZLIB:
+            payload = zlib.decompress(payload)
+        if kind == self.KIND_BYTES:
+            return payload
+        if kind == self.KIND_STR:
+            return payload.decode("utf-8")
+        return json.loads(payload)
+
+    def stats(self) -> dict:
+        return dict(
+            self.counters, bytes_saved=self.counters["bytes_raw"] - self.counters["bytes_stored"]
+        )
+
 
 class RedisCache:
-    def __init__(self, url: str, db: int = 0):
+    """同步缓存，仅供脚本使用；服务中请使用 AsyncRedisCache。"""
+
+    def __init__(self, url: str, db: int = 0, codec: CacheCodec = None):
         """
         使用连接 URL 初始化 Redis 客户端连接
         :param url: Redis 连接 URL
         :param db: Redis 数据库编号，默认为 0
+        :param codec: 值编码器
         """
         self.client = redis.Redis.from_url(url, db=db)
+        self.codec = codec or CacheCodec()
 
     def set_cache(self, key: str, value, expire: Optional[int] = None) -> bool:
         """
         设置缓存
         :param key: 缓存键
-        :param value: 缓存值，可以是任意数据类型，将被转换为 JSON 字符串
+        :param value: 缓存值，bytes / str 原样存储，其他值编码为 JSON
         :param expire: 过期时间，单位为秒。若为 None，则永久有效
         :return: 成功返回 True，失败返回 False
         """
         try:
-            value_json = json.dumps(value)  # 将值转换为 JSON 字符串
-            self.client.set(name=key, value=value_json, ex=expire)
+            self.client.set(name=key, value=self.codec.encode(value), ex=expire)
             return True
         except Exception as e:
             print(f"Error setting cache: {e}")
@@ -34,10 +186,7 @@ class RedisCache:
         :return: 返回原始数据类型的值，如果键不存在则返回 None
         """
         try:
-            value = self.client.get(name=key)
-            if value is not None:
-                return json.loads(value)  # 将 JSON 字符串转换回原始数据类型
-            return None
+            return self.codec.decode(self.client.get(name=key))
         except Exception as e:
             print(f"Error getting cache: {e}")
             return None
@@ -54,14 +203,411 @@ class RedisCache:
             print(f"Error deleting cache: {e}")
             return False
 
-    def clear_cache(self) -> bool:
+    def clear_cache(self, pattern: str = "cache:*") -> bool:
         """
-        清空 Redis 数据库中的所有缓存
-        :return: 成功清空返回 True，否则返回 False
+        按模式增量删除缓存（SCAN + UNLINK），不会清掉同库中的向量索引
+        :param pattern: 键模式，默认为全部命名空间缓存
+        :return: 成功返回 True，否则返回 False
         """
         try:
-            self.client.flushdb()
+            unlink_matching(self.client, pattern)
             return True
         except Exception as e:
             print(f"Error clearing cache: {e}")
-            return False
\ No newline at end of file
+            return False
+
+class AsyncRedisCache:
+    """
+    基于 redis.asyncio 的缓存，值由 CacheCodec 编码，可读取 RedisCache 写入的旧 JSON 值。
+    所有实例共享同一个连接池，读写不阻塞事件循环。
+    """
+
+    _pools: Dict[str, aioredis.ConnectionPool] = {}
+
+    def __init__(
+        self, url: str, db: int = 0, max_connections: int = 64, codec: CacheCodec = None
+    ):
+        """
+        使用连接 URL 初始化异步 Redis 客户端
+        :param url: Redis 连接 URL
+        :param db: Redis 数据库编号，默认为 0
+        :param max_connections: 连接池最大连接数
+        :param codec: 值编码器
+        """
+        self.codec = codec or CacheCodec()
+        pool_key = f"{url}/{db}"
+        pool = AsyncRedisCache._pools.get(pool_key)
+        if pool is None:
+            pool = aioredis.ConnectionPool.from_url(url, db=db, max_connections=max_connections)
+            AsyncRedisCache._pools[pool_key] = pool
+        self.client = aioredis.Redis(connection_pool=pool)
+        self._namespaces: Dict[str, "CacheNamespace"] = {}
+
+    def _decode(self, data: Optional[bytes]):
+        """解码缓存值，无法解码时记录日志并按未命中返回 None"""
+        try:
+            return self.codec.decode(data)
+        except Exception as e:
+            log.error(f"Error decoding cache value: {e}")
+            return None
+
+    async def get(self, key: str):
+        """
+        获取缓存
+        :param key: 缓存键
+        :return: 返回原始数据类型的值，如果键不存在、读取或解码失败则返回 None
+        """
+        try:
+            data = await self.client.get(key)
+        except Exception as e:
+            log.error(f"Error getting cache: {e}")
+            return None
+        return self._decode(data)
+
+    async def set(self, key: str, value, expire: Optional[int] = None) -> bool:
+        """
+        设置缓存
+        :param key: 缓存键
+        :param value: 缓存值，bytes / str 原样存储，其他值编码为 JSON
+        :param expire: 过期时间，单位为秒。若为 None，则永久有效
+        :return: 成功返回 True，失败返回 False
+        """
+        try:
+            await self.client.set(key, self.codec.encode(value), ex=expire)
+            return True
+        except Exception as e:
+            log.error(f"Error setting cache: {e}")
+            return False
+
+    async def delete(self, *keys: str) -> int:
+        """
+        删除缓存
+        :return: 删除的键数量
+        """
+        try:
+            return await self.client.unlink(*keys) if keys else 0
+        except Exception as e:
+            log.error(f"Error deleting cache: {e}")
+            return 0
+
+    async def mget(self, keys: List[str]) -> List:
+        """批量获取缓存，与 keys 一一对应，不存在的为 None"""
+        if not keys:
+            return []
+        try:
+            found = await self.client.mget(keys)
+        except Exception as e:
+            log.error(f"Error getting cache: {e}")
+            return [None] * len(keys)
+        return [self._decode(v) for v in found]
+
+    async def mset(self, items: dict, expire: Optional[int] = None) -> bool:
+        """批量设置缓存，使用一次 pipeline 往返"""
+        if not items:
+            return True
+        try:
+            async with self.client.pipeline(transaction=False) as pipe:
+                for key, value in items.items():
+                    pipe.set(key, self.codec.encode(value), ex=expire)
+                await pipe.execute()
+            return True
+        except Exception as e:
+            log.error(f"Error setting cache: {e}")
+            return False
+
+    def pipeline(self, transaction: bool = False):
+        """返回底层客户端的 pipeline，用于自定义批量命令"""
+        return self.client.pipeline(transaction=transaction)
+
+    def namespace(self, name: str, ttl: Optional[int] = None) -> "CacheNamespace":
+        """
+        返回命名空间视图，同名命名空间复用同一实例
+        :param name: 命名空间名称，如 rag / llm / embeddings
+        :param ttl: 默认过期时间，为空时依次取 CACHE_TTL_{NAME} 和 NAMESPACE_TTLS
+        """
+        if name not in self._namespaces:
+            self._namespaces[name] = CacheNamespace(self, name, ttl)
+        return self._namespaces[name]
+
+    async def clear(self, pattern: str = "cache:*") -> bool:
+        """
+        按模式增量删除缓存（SCAN + UNLINK），不会清掉同库中的向量索引
+        :param pattern: 键模式，默认为全部命名空间缓存
+        :return: 成功返回 True，否则返回 False
+        """
+        try:
+            await aunlink_matching(self.client, pattern)
+            return True
+        except Exception as e:
+            log.error(f"Error clearing cache: {e}")
+            return False
+
+    async def close(self):
+        """关闭客户端并断开共享连接池，在应用关闭时调用"""
+        await self.client.aclose()
+        await self.client.connection_pool.disconnect()
+
+
+class TieredCache(AsyncRedisCache):
+    """
+    两级缓存：进程内按字节数限制的 LRU + Redis。
+
+    本地层保存编码后的字节，命中时再解码，占用的内存与 max_bytes 的计量一致，
+    每次返回的都是新对象。本地层条目的存活时间不超过 local_ttl 秒，
+    其他 worker 的写入和删除最多延迟这么久可见。
+    """
+
+    def __init__(
+        self,
+        url: str,
+        db: int = 0,
+        max_connections: int = 64,
+        codec: CacheCodec = None,
+        max_bytes: int = 64 * 1024 * 1024,
+        local_ttl: int = 300,
+    ):
+        """
+        :param max_bytes: 本地层最大字节数（按编码后的大小计算，与实际保存的内容一致）
+        :param local_ttl: 本地层条目最长存活时间，单位为秒
+        """
+        super().__init__(url, db, max_connections, codec)
+        self.max_bytes = max_bytes
+        self.local_ttl = local_ttl
+        self._lru = OrderedDict()
+        self._bytes = 0
+        self.counters = {"local_hits": 0, "redis_hits": 0, "misses": 0}
+
+    def _local_get(self, key: str):
+        entry = self._lru.get(key)
+        if entry is None:
+            return None
+        if entry[2] < time.monotonic():
+            self._local_pop(key)
+            return None
+        self._lru.move_to_end(key)
+        return entry
+
+    def _local_set(self, key: str, data: bytes, expire: Optional[int] = None):
+        self._local_pop(key)
+        size = len(data)
+        if size > self.max_bytes // 8:
+            return
+        ttl = min(expire, self.local_ttl) if expire else self.local_ttl
+        self._lru[key] = (data, size, time.monotonic() + ttl)
+        self._bytes += size
+        while self._bytes > self.max_bytes:
+            _, (_, evicted, _) = self._lru.popitem(last=False)
+            self._bytes -= evicted
+
+    def _local_pop(self, key: str):
+        entry = self._lru.pop(key, None)
+        if entry is not None:
+            self._bytes -= entry[1]
+
+    async def get(self, key: str):
+        entry = self._local_get(key)
+        if entry is not None:
+            self.counters["local_hits"] += 1
+            return self._decode(entry[0])
+        try:
+            data = await self.client.get(key)
+        except Exception as e:
+            log.error(f"Error getting cache: {e}")
+            data = None
+        value = self._decode(data)
+        if value is None:
+            self.counters["misses"] += 1
+            return None
+        self._local_set(key, data)
+        self.counters["redis_hits"] += 1
+        return value
+
+    async def set(self, key: str, value, expire: Optional[int] = None) -> bool:
+        data = self.codec.encode(value)
+        try:
+            await self.client.set(key, data, ex=expire)
+        except Exception as e:
+            log.error(f"Error setting cache: {e}")
+            self._local_pop(key)
+            return False
+        self._local_set(key, data, expire)
+        return True
+
+    async def delete(self, *keys: str) -> int:
+        for key in keys:
+            self._local_pop(key)
+        return await super().delete(*keys)
+
+    async def mget(self, keys: List[str]) -> List:
+        values, missing = [], []
+        for i, key in enumerate(keys):
+            entry = self._local_get(key)
+            values.append(self._decode(entry[0]) if entry is not None else None)
+            if entry is None:
+                missing.append(i)
+        self.counters["local_hits"] += len(keys) - len(missing)
+        if missing:
+            try:
+                found = await self.client.mget([keys[i] for i in missing])
+            except Exception as e:
+                log.error(f"Error getting cache: {e}")
+                found = [None] * len(missing)
+            for i, data in zip(missing, found):
+                values[i] = self._decode(data)
+                if values[i] is None:
+                    self.counters["misses"] += 1
+                    continue
+                self._local_set(keys[i], data)
+                self.counters["redis_hits"] += 1
+        return values
+
+    async def mset(self, items: dict, expire: Optional[int] = None) -> bool:
+        encoded = {key: self.codec.encode(value) for key, value in items.items()}
+        try:
+            async with self.client.pipeline(transaction=False) as pipe:
+                for key, data in encoded.items():
+                    pipe.set(key, data, ex=expire)
+                await pipe.execute()
+        except Exception as e:
+            log.error(f"Error setting cache: {e}")
+            for key in items:
+                self._local_pop(key)
+            return False
+        for key, data in encoded.items():
+            self._local_set(key, data, expire)
+        return True
+
+    async def clear(self, pattern: str = "cache:*") -> bool:
+        self._lru.clear()
+        self._bytes = 0
+        return await super().clear(pattern)
+
+    def stats(self) -> dict:
+        total = sum(self.counters.values())
+        data = dict(self.counters, local_entries=len(self._lru), local_bytes=self._bytes)
+        data["local_hit_ratio"] = round(self.counters["local_hits"] / total, 4) if total else 0.0
+        data["redis_hit_ratio"] = round(self.counters["redis_hits"] / total, 4) if total else 0.0
+        data.update(self.codec.stats())
+        return data
+
+
+class CacheNamespace:
+    """
+    缓存命名空间，键格式为 cache:{name}:{generation}:{key}。
+
+    invalidate 只递增代号（cachegen:{name}），调用方 O(1) 返回，旧代的键在后台用
+    SCAN + UNLINK 分批回收，未回收完的旧键也会按 TTL 过期。
+    其他 worker 最多 generation_ttl 秒后看到新代号；写入后会重新读取代号，
+    期间命名空间被失效时删除刚写入的旧代键，这些键不会存活到 TTL。
+    """
+
+    def __init__(
+        self,
+        cache: AsyncRedisCache,
+        name: str,
+        ttl: Optional[int] = None,
+        generation_ttl: float = 1.0,
+    ):
+        """
+        :param cache: 底层缓存
+        :param name: 命名空间名称
+        :param ttl: 默认过期时间，单位为秒
+        :param generation_ttl: 进程内缓存代号的时间，单位为秒
+        """
+        self.cache = cache
+        self.name = name
+        env_ttl = os.environ.get(f"CACHE_TTL_{name.upper()}")
+        self.ttl = ttl or (int(env_ttl) if env_ttl else NAMESPACE_TTLS.get(name))
+        self.generation_key = f"cachegen:{name}"
+        self.generation_ttl = generation_ttl
+        self._generation = None
+        self._generation_at = 0.0
+        self._purge_task: Optional[asyncio.Task] = None
+
+    async def generation(self, refresh: bool = False) -> int:
+        if (
+            refresh
+            or self._generation is None
+            or time.monotonic() - self._generation_at > self.generation_ttl
+        ):
+            try:
+                self._generation = int(await self.cache.client.get(self.generation_key) or 0)
+            except Exception as e:
+                log.error(f"Error getting cache generation: {e}")
+                self._generation = self._generation or 0
+            self._generation_at = time.monotonic()
+        return self._generation
+
+    def _format(self, generation: int, key: str) -> str:
+        return f"cache:{self.name}:{generation}:{key}"
+
+    async def full_key(self, key: str) -> str:
+        """命名空间内的键在 Redis 中的完整键名（当前代）"""
+        return self._format(await self.generation(), key)
+
+    async def _check_written(self, generation: int, keys: List[str]):
+        """
+        写入后重新读取代号。代号在写入前已变化时删除刚写入的键；写入后才变化时，
+        这些键在 purge 开始前已存在，会被 purge 回收。
+        """
+        if await self.generation(refresh=True) != generation:
+            await self.cache.delete(*keys)
+
+    async def get(self, key: str):
+        return await self.cache.get(await self.full_key(key))
+
+    async def set(self, key: str, value, expire: Optional[int] = None) -> bool:
+        generation = await self.generation()
+        full_key = self._format(generation, key)
+        ok = await self.cache.set(full_key, value, expire=expire or self.ttl)
+        if ok:
+            await self._check_written(generation, [full_key])
+        return ok
+
+    async def delete(self, *keys: str) -> int:
+        return await self.cache.delete(*[await self.full_key(k) for k in keys])
+
+    async def mget(self, keys: List[str]) -> List:
+        prefix = await self.full_key("")
+        return await self.cache.mget([prefix + k for k in keys])
+
+    async def mset(self, items: dict, expire: Optional[int] = None) -> bool:
+        generation = await self.generation()
+        prefix = self._format(generation, "")
+        ok = await self.cache.mset(
+            {prefix + k: v for k, v in items.items()}, expire=expire or self.ttl
+        )
+        if ok and items:
+            await self._check_written(generation, [prefix + k for k in items])
+        return ok
+
+    async def invalidate(self) -> int:
+        """
+        使命名空间内的全部缓存失效，旧代键在后台回收
+        :return: 新的代号
+        """
+        self._generation = await self.cache.client.incr(self.generation_key)
+        self._generation_at = time.monotonic()
+        if self._purge_task is None or self._purge_task.done():
+            self._purge_task = asyncio.create_task(self.purge())
+        return self._generation
+
+    async def purge(self, batch_size: int = 500, interval: float = 0.01) -> int:
+        """删除当前代之前的键，每批之间暂停 interval 秒"""
+        deleted = 0
+        while True:
+            generation = await self.generation(refresh=True)
+            current = self._format(generation, "").encode()
+            deleted += await aunlink_matching(
+                self.cache.client,
+                f"cache:{self.name}:*",
+                batch_size,
+                interval,
+                keep=lambda key: key.startswith(current),
+            )
+            # 回收期间命名空间再次失效时再扫描一轮，中间代写入的键也要回收
+            if await self.generation(refresh=True) == generation:
+                break
+        if deleted:
+            log.info(f"cache namespace {self.name} purged {deleted} keys")
+        return deleted
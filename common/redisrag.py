@@ -21,6 +21,9 @@ from langchain_community.document_loaders import UnstructuredEmailLoader
 from langchain_community.document_loaders import EverNoteLoader
 from langchain_community.vectorstores.redis import Redis
 from langchain_community.vectorstores.redis.base import check_index_exists
+from langchain_community.utilities.redis import TokenEscaper
+from langchain_core.documents import Document
+from redis.commands.search.query import Query
 from langchain_text_splitters import RecursiveCharacterTextSplitter
 from langchain_community.document_loaders import (
     TextLoader,
@@ -28,27 +31,109 @@ from langchain_community.document_loaders import (
     UnstructuredMarkdownLoader,
     UnstructuredEPubLoader,
 )
-from typing import List
+from typing import Dict, List, Sequence, Tuple
 import os
+import re
+import asyncio
+import concurrent.futures
+import functools
+import time
 import logging
+import threading
+import httpx
+import redis
 import tiktoken
 
+from common.embedcache import CachedEmbeddings
+from common.ingest import IngestPipeline
+from common.localindex import get_local_index, release_local_index
+from common.pgvector import PG_MAX_INDEX_DIMENSIONS, PgVectorStore, close_pg_pool
+from common.indexconfig import (
+    FilterError,
+    IndexConfig,
+    filter_values,
+    bump_index_version,
+    delete_index_alias,
+    get_index_version,
+    index_key_prefix,
+    rescore,
+    resolve_index,
+    retire_index_results,
+    set_index_alias,
+    versioned_index_name,
+)
+
 log = logging.getLogger(__name__)
 
 
-def tokens_len(string: str) -> int:
+@functools.lru_cache(maxsize=32)
+def get_encoding(model: str = None) -> tiktoken.Encoding:
+    """
+    获取并缓存 tiktoken 编码器，未知模型回退到 cl100k_base。
+
+    Args:
+        model (str, optional): 模型名称，为空时使用 cl100k_base。
+
+    Returns:
+        tiktoken.Encoding: 编码器。
+    """
+    if model:
+        try:
+            return tiktoken.encoding_for_model(model)
+        except KeyError:
+            log.warning(f"unknown tokenizer model {model}, fallback to cl100k_base")
+    return tiktoken.get_encoding("cl100k_base")
+
+
+def tokens_len(string: str, model: str = None) -> int:
     """
     计算字符串的令牌数。
 
     Args:
         string (str): 要计算令牌数的字符串。
+        model (str, optional): 模型名称，决定使用的编码器。
 
     Returns:
         int: 字符串的令牌数。
     """
-    encoding = tiktoken.get_encoding("cl100k_base")
-    num_tokens = len(encoding.encode(string))
-    return num_tokens
+    return len(get_encoding(model).encode(string, disallowed_special=()))
+
+
+def tokens_len_batch(strings: List[str], model: str = None, num_threads: int = 8) -> List[int]:
+    """
+    批量计算令牌数，由 encode_batch 在线程池中并行编码。
+
+    Args:
+        strings (List[str]): 字符串列表。
+        model (str, optional): 模型名称，决定使用的编码器。
+        num_threads (int, optional): 编码线程数。
+
+    Returns:
+        List[int]: 与输入一一对应的令牌数。
+    """
+    tokens = get_encoding(model).encode_batch(
+        strings, num_threads=num_threads, disallowed_special=()
+    )
+    return [len(t) for t in tokens]
+
+
+def truncate_tokens(string: str, max_tokens: int, model: str = None) -> str:
+    """
+    按令牌数截断字符串。
+
+    Args:
+        string (str): 要截断的字符串。
+        max_tokens (int): 保留的最大令牌数。
+        model (str, optional): 模型名称，决定使用的编码器。
+
+    Returns:
+        str: 截断后的字符串。
+    """
+    encoding = get_encoding(model)
+    tokens = encoding.encode(string, disallowed_special=())
+    if len(tokens) <= max_tokens:
+        return string
+    return encoding.decode(tokens[:max_tokens])
 
 
 def get_loader_from_file(filepath: str):
@@ -108,9 +193,147 @@ def OpenAIEmbeddings(**kwargs):
         deployment=os.environ.get("OPENAI_EMBEDDING_MODEL"),
         openai_api_version=os.environ.get("AZURE_OPENAI_API_VERSION"),
         validate_base_url=False,
+        dimensions=kwargs.get("dimensions"),
+        http_client=kwargs.get("http_client"),
+        http_async_client=kwargs.get("http_async_client"),
     )
 
 
+_shared_lock = threading.Lock()
+_redis_pool = None
+_shared_embeddings = {}
+_embedding_http_clients = []
+
+
+def get_redis_client() -> redis.Redis:
+    """返回共享连接池上的 Redis 客户端。"""
+    global _redis_pool
+    with _shared_lock:
+        if _redis_pool is None:
+            _redis_pool = redis.ConnectionPool.from_url(
+                os.environ["REDIS_URL"],
+                max_connections=int(os.environ.get("REDIS_MAX_CONNECTIONS", 64)),
+            )
+    return redis.Redis(connection_pool=_redis_pool)
+
+
+# 嵌入模型的默认输出维度
+EMBEDDING_MODEL_DIMENSIONS = {
+    "text-embedding-3-large": 3072,
+    "text-embedding-3-small": 1536,
+    "text-embedding-ada-002": 1536,
+}
+
+
+def get_shared_embeddings(model: str, dimensions: int = None):
+    """
+    返回进程内共享的嵌入客户端，同一模型和维度复用同一个 HTTP 连接池。
+
+    Args:
+        model (str): 嵌入模型名称。
+        dimensions (int, optional): 输出维度，为空时使用模型默认维度。
+
+    Returns:
+        AzureOpenAIEmbeddings: 共享的嵌入客户端。
+    """
+    key = f"{model}:{dimensions}"
+    with _shared_lock:
+        embeddings = _shared_embeddings.get(key)
+        if embeddings is None:
+            limits = httpx.Limits(
+                max_connections=int(os.environ.get("EMBEDDING_MAX_CONNECTIONS", 32)),
+                keepalive_expiry=60,
+            )
+            http_client = httpx.Client(limits=limits)
+            http_async_client = httpx.AsyncClient(limits=limits)
+            embeddings = OpenAIEmbeddings(
+                model=model,
+                dimensions=dimensions,
+                http_client=http_client,
+                http_async_client=http_async_client,
+            )
+            _shared_embeddings[key] = embeddings
+            _embedding_http_clients.append((http_client, http_async_client))
+        return embeddings
+
+
+async def aclose_shared_embeddings():
+    """关闭共享嵌入客户端的 HTTP 连接池，在应用关闭时调用。"""
+    with _shared_lock:
+        clients = list(_embedding_http_clients)
+        _embedding_http_clients.clear()
+        _shared_embeddings.clear()
+    for http_client, http_async_client in clients:
+        http_client.close()
+        await http_async_client.aclose()
+
+
+def get_query_embeddings(model: str, dimensions: int = None) -> CachedEmbeddings:
+    """返回带查询向量缓存的共享嵌入客户端。"""
+    embeddings = get_shared_embeddings(model, dimensions)
+    key = f"cached:{model}:{dimensions}"
+    with _shared_lock:
+        cached = _shared_embeddings.get(key)
+        if cached is None:
+            label = f"{model}@{dimensions}" if dimensions else model
+            cached = CachedEmbeddings(embeddings, label)
+            _shared_embeddings[key] = cached
+        return cached
+
+
+class VectorDBRegistry:
+    """
+    进程级向量库注册表，每个索引保留一个长期存活的向量库实例。
+
+    实例按索引配置的 revision 缓存，其他进程删除、重建或修改索引配置后 revision 变化，
+    下次 get 时重新创建（最多滞后配置缓存的 60 秒）。空闲超过 idle_timeout 秒的实例会被淘汰。
+    """
+
+    def __init__(self, idle_timeout: int = 1800):
+        self.idle_timeout = idle_timeout
+        self._entries = {}
+        self._lock = threading.Lock()
+        self._last_sweep = time.monotonic()
+
+    def get(self, index_name: str, factory, revision: str = None):
+        """
+        :param index_name: 物理索引名称
+        :param factory: 创建向量库实例的函数
+        :param revision: 当前索引配置的 revision，与缓存实例的不一致时重新创建
+        """
+        now = time.monotonic()
+        with self._lock:
+            self._evict_idle(now)
+            entry = self._entries.get(index_name)
+            if entry is not None and entry[2] == revision:
+                entry[1] = now
+                return entry[0]
+        vdb = factory()
+        with self._lock:
+            entry = self._entries.get(index_name)
+            if entry is None or entry[2] != revision:
+                entry = self._entries[index_name] = [vdb, now, revision]
+            return entry[0]
+
+    def invalidate(self, index_name: str):
+        with self._lock:
+            self._entries.pop(index_name, None)
+
+    def _evict_idle(self, now: float):
+        if now - self._last_sweep < 60:
+            return
+        self._last_sweep = now
+        for name, (_, last_used, _) in list(self._entries.items()):
+            if now - last_used > self.idle_timeout:
+                log.info(f"evict idle vectordb {name}")
+                del self._entries[name]
+
+
+vectordb_registry = VectorDBRegistry(
+    idle_timeout=int(os.environ.get("VECTORDB_IDLE_TIMEOUT", 1800))
+)
+
+
 def get_redis_retriever(indexname: str, topk: int = 3):
     """Create a Redis retriever from a indexname."""
     embedding_model = os.environ.get("OPENAI_EMBEDDING_MODEL", "text-embedding-3-large")
@@ -132,9 +355,125 @@ def get_redis_retriever(indexname: str, topk: int = 3):
     return retriever
 
 
+def reciprocal_rank_fusion(
+    result_lists: Sequence[List[Tuple[Document, float]]],
+    weights: Sequence[float],
+    k: int = 60,
+) -> List[Tuple[Document, float]]:
+    """
+    加权倒数排名融合（RRF），按文档 id 合并多路检索结果。
+
+    Args:
+        result_lists: 每一路检索的 (Document, score) 列表，已按相关度降序排列。
+        weights: 每一路的权重。
+        k (int, optional): RRF 平滑常数。默认为 60。
+
+    Returns:
+        List[Tuple[Document, float]]: 按融合得分降序排列的结果。
+    """
+    fused: Dict[str, List] = {}
+    for results, weight in zip(result_lists, weights):
+        if not weight:
+            continue
+        for rank, (doc, _) in enumerate(results):
+            doc_id = doc.metadata.get("id") or doc.page_content
+            entry = fused.setdefault(doc_id, [doc, 0.0])
+            entry[1] += weight / (k + rank + 1)
+    return sorted(((doc, score) for doc, score in fused.values()), key=lambda x: -x[1])
+
+
+_token_escaper = TokenEscaper()
+
+
+def _run_sync(main):
+    """
+    在同步代码中执行协程函数 main，结束后关闭本次使用的 pgvector 连接池。
+
+    当前线程已有运行中的事件循环时（如 Jupyter 或协程中的同步调用），
+    在新线程的事件循环中执行并阻塞等待，与改为流水线之前的同步实现行为一致；
+    协程中应优先使用 afrom_texts / afrom_files。
+    """
+
+    async def run():
+        try:
+            return await main()
+        finally:
+            await close_pg_pool()
+
+    try:
+        asyncio.get_running_loop()
+    except RuntimeError:
+        return asyncio.run(run())
+    with concurrent.futures.ThreadPoolExecutor(max_workers=1) as pool:
+        return pool.submit(lambda: asyncio.run(run())).result()
+
+
+def _text_phrase(field: str, value) -> str:
+    """把值切分为词后组成短语，与 TEXT 字段建索引时的分词方式一致。"""
+    terms = re.findall(r"\w+", str(value))
+    if not terms:
+        raise FilterError(f"Filter value {value!r} for text field {field} has no searchable terms")
+    return " ".join(terms)
+
+
+def build_filter_expression(filters: List[dict], config: IndexConfig, index_name: str) -> str:
+    """
+    把类型化过滤条件转换为 RediSearch 查询表达式，多个条件之间为 AND。
+
+    每个条件为 {"field", "op", "value", "min", "max"}，op 取值：
+    eq / in / prefix 用于 TAG 字段，range 用于 NUMERIC 字段。
+    旧索引中的 TEXT 字段也支持 eq / in / prefix，按分词后的短语匹配，不是精确相等。
+
+    Args:
+        filters (List[dict]): 过滤条件。
+        config (IndexConfig): 索引配置，用于校验字段类型。
+        index_name (str): 索引名称。
+
+    Returns:
+        str: 查询表达式，无过滤条件时为 "*"。条件无效时抛出 FilterError。
+    """
+    clauses = []
+    for f in filters or []:
+        field, op = f["field"], f.get("op", "eq")
+        kind = config.field_type(field)
+        if kind is None:
+            raise FilterError(f"Field {field} is not indexed in {index_name}")
+        if op in ("eq", "in", "prefix"):
+            if kind not in ("tag", "text"):
+                raise FilterError(f"Operator {op} requires a tag field, {field} is {kind}")
+            values = filter_values(f)
+            if kind == "text":
+                phrases = [_text_phrase(field, v) for v in values]
+                if op == "prefix":
+                    phrases = [f"({p}*)" for p in phrases]
+                else:
+                    phrases = [f'"{p}"' for p in phrases]
+                clauses.append(f"@{field}:({'|'.join(phrases)})")
+                continue
+            if op == "prefix":
+                values = [f"{_token_escaper.escape(str(v))}*" for v in values]
+            else:
+                values = [_token_escaper.escape(str(v)) for v in values]
+            clauses.append(f"@{field}:{{{'|'.join(values)}}}")
+        elif op == "range":
+            if kind != "numeric":
+                raise FilterError(f"Operator range requires a numeric field, {field} is {kind}")
+            low = "-inf" if f.get("min") is None else f["min"]
+            high = "+inf" if f.get("max") is None else f["max"]
+            clauses.append(f"@{field}:[{low} {high}]")
+        else:
+            raise FilterError(f"Unsupported filter operator {op}")
+    return f"({' '.join(clauses)})" if clauses else "*"
+
+
 class RedisRag(object):
 
     embedding_model = os.environ.get("OPENAI_EMBEDDING_MODEL", "text-embedding-3-large")
+    vector_schema = {
+        "algorithm": "HNSW",
+        "distance_metric": "cosine",
+        "metadata_keys": ["blob_name", "blob_uri"],
+    }
 
     @staticmethod
     def from_text(
@@ -146,91 +485,618 @@ class RedisRag(object):
             chunk_size=splitlen, chunk_overlap=0, length_function=tokens_len
         )
         texts = text_splitter.split_text(text)
-        return Redis.from_texts(
-            texts,
-            OpenAIEmbeddings(model=RedisRag.embedding_model),
-            metadatas=metadata,
+        return RedisRag.from_texts(
+            indexname, texts, [metadata] * len(texts) if metadata else None
+        )
+
+    @staticmethod
+    def resolve_index(index_name: str) -> str:
+        """返回逻辑索引当前指向的物理索引。"""
+        return resolve_index(get_redis_client(), index_name)
+
+    @staticmethod
+    def get_index_config(index_name: str, ttl: int = 60) -> IndexConfig:
+        client = get_redis_client()
+        return IndexConfig.load(client, resolve_index(client, index_name), ttl=ttl)
+
+    @staticmethod
+    def get_store(index_name: str, config: IndexConfig = None):
+        """返回不在 Redis 中的索引的向量库（如 PgVectorStore），Redis 索引返回 None。"""
+        config = config or RedisRag.get_index_config(index_name)
+        if config.backend == "pgvector":
+            return PgVectorStore(
+                RedisRag.resolve_index(index_name),
+                config.backend_options,
+                config.filter_fields,
+            )
+        return None
+
+    @staticmethod
+    def get_index_version(index_name: str) -> str:
+        """检索结果缓存使用的版本：当前物理索引及其内容版本号，入库或切换别名后都会变化。"""
+        client = get_redis_client()
+        physical_name = resolve_index(client, index_name)
+        return f"{physical_name}:{get_index_version(client, physical_name)}"
+
+    @staticmethod
+    def configure_index(
+        index_name: str,
+        vector_dtype: str = "FLOAT32",
+        rescore: bool = None,
+        dimensions: int = None,
+        filter_fields: dict = None,
+        backend: str = "redis",
+        backend_options: dict = None,
+    ) -> IndexConfig:
+        """
+        声明索引的向量库、向量存储类型（FLOAT32 / FLOAT16 / INT8）、嵌入维度和过滤字段，须在首次写入前调用。
+
+        Args:
+            index_name (str): 索引名称。
+            vector_dtype (str, optional): 向量存储类型。
+            rescore (bool, optional): 检索时是否精确重排，INT8 默认开启。
+            dimensions (int, optional): 嵌入维度，为空时使用模型默认维度。
+            filter_fields (dict, optional): 过滤字段及类型，如 {"blob_name": "tag", "page": "numeric"}。
+            backend (str, optional): 向量库，redis 或 pgvector。
+            backend_options (dict, optional): 向量库的索引选项，pgvector 支持
+                index_type (hnsw / ivfflat)、m、ef_construction、ef_search、lists、probes。
+                pgvector 索引最多 2000 维，默认维度更高的模型需要通过 dimensions 降维。
+
+        Returns:
+            IndexConfig: 生效的索引配置。
+        """
+        if backend == "pgvector":
+            effective = dimensions or EMBEDDING_MODEL_DIMENSIONS.get(RedisRag.embedding_model)
+            if effective is None or effective > PG_MAX_INDEX_DIMENSIONS:
+                raise ValueError(
+                    f"pgvector indexes support at most {PG_MAX_INDEX_DIMENSIONS} dimensions, "
+                    f"{RedisRag.embedding_model} produces {effective or 'unknown'}; set dimensions"
+                )
+        client = get_redis_client()
+        index_name = resolve_index(client, index_name)
+        existing = IndexConfig.load(client, index_name, ttl=0)
+        if existing.backend != backend and client.exists(f"ragfp:{index_name}"):
+            raise ValueError(f"Index {index_name} already lives on {existing.backend}")
+        if check_index_exists(client, index_name):
+            if existing.vector_dtype != vector_dtype.upper():
+                raise ValueError(
+                    f"Index {index_name} already stores {existing.vector_dtype} vectors"
+                )
+            if dimensions and existing.dimensions != dimensions:
+                raise ValueError(
+                    f"Index {index_name} already stores {existing.dimensions or 'default'}-dimension vectors"
+                )
+            return existing
+        config = IndexConfig(
+            vector_dtype,
+            rescore=rescore,
+            dimensions=dimensions,
+            filter_fields=filter_fields,
+            backend=backend,
+            backend_options=backend_options,
+            **existing.extra,
+        )
+        config.save(client, index_name)
+        return config
+
+    @staticmethod
+    def _create_pipeline(indexname: str, **pipeline_kwargs) -> IngestPipeline:
+        indexname = RedisRag.resolve_index(indexname)
+        vector_dtype = pipeline_kwargs.pop("vector_dtype", None)
+        rescore_option = pipeline_kwargs.pop("rescore", None)
+        dimensions = pipeline_kwargs.pop("dimensions", None)
+        filter_fields = pipeline_kwargs.pop("filter_fields", None)
+        backend = pipeline_kwargs.pop("backend", None)
+        backend_options = pipeline_kwargs.pop("backend_options", None)
+        if vector_dtype or dimensions or filter_fields or backend:
+            index_config = RedisRag.configure_index(
+                indexname,
+                vector_dtype or "FLOAT32",
+                rescore_option,
+                dimensions,
+                filter_fields,
+                backend or "redis",
+                backend_options,
+            )
+        else:
+            index_config = RedisRag.get_index_config(indexname, ttl=0)
+        pipeline_kwargs.setdefault(
+            "embed_batch_size", int(os.environ.get("INGEST_EMBED_BATCH_SIZE", 64))
+        )
+        pipeline_kwargs.setdefault(
+            "streaming", os.environ.get("INGEST_STREAMING", "1") in ["1", "true"]
+        )
+        return IngestPipeline(
+            indexname,
+            get_shared_embeddings(RedisRag.embedding_model, index_config.dimensions),
             redis_url=os.environ["REDIS_URL"],
-            index_name=indexname,
+            embedding_model=index_config.embedding_label(RedisRag.embedding_model),
+            client=get_redis_client(),
+            vector_schema=RedisRag.vector_schema,
+            index_config=index_config,
+            length_function=tokens_len,
+            store=RedisRag.get_store(indexname, index_config),
+            **pipeline_kwargs,
         )
 
+    @staticmethod
+    async def afrom_texts(
+        indexname: str,
+        texts: List[str],
+        metadatas: List[dict] = None,
+        sync: bool = False,
+        **pipeline_kwargs,
+    ):
+        """
+        Create a Redis index from a list of texts.
+
+        Texts already present in the index (same content, metadata and embedding
+        model) are not embedded again. With sync=True, chunks of the index that
+        are not in texts are deleted.
+        """
+        pipeline = await asyncio.to_thread(RedisRag._create_pipeline, indexname, **pipeline_kwargs)
+        return await pipeline.run_texts(texts, metadatas, sync=sync)
+
     @staticmethod
     def from_texts(
         indexname: str,
         texts: List[str],
         metadatas: List[dict] = None,
+        sync: bool = False,
+        **pipeline_kwargs,
     ):
-        """Create a Redis index from a list of texts."""
-        return Redis.from_texts(
-            texts,
-            OpenAIEmbeddings(model=RedisRag.embedding_model),
-            metadatas=metadatas,
-            redis_url=os.environ["REDIS_URL"],
-            index_name=indexname,
+        """
+        Synchronous wrapper of afrom_texts. Blocks the calling thread; when called
+        inside a running event loop the pipeline runs on a separate thread, so
+        coroutines should await afrom_texts instead.
+        """
+        return _run_sync(
+            lambda: RedisRag.afrom_texts(indexname, texts, metadatas, sync, **pipeline_kwargs)
         )
 
     @staticmethod
-    def from_files(
+    async def afrom_files(
         indexname: str,
         filepaths: List[str],
         splitlen: int = 1024,
         metadatas: List[dict] = None,
+        sync: bool = False,
+        **pipeline_kwargs,
     ):
-        # sourcery skip: low-code-quality
         """
-        Load and process documents from a list of filepaths.
+        Load, split, embed and write documents through the ingestion pipeline.
+
+        Chunks already present in the index are skipped, so re-ingesting a
+        mostly unchanged corpus only embeds the difference.
 
         Args:
             indexname (str): The name of the index.
             filepaths (List[str]): A list of filepaths to load documents from.
             splitlen (int, optional): The length to split the documents into. Defaults to 1024.
+            metadatas (List[dict], optional): Metadata for each file, in the same order as filepaths.
+            sync (bool, optional): Treat filepaths as the full corpus and delete chunks that disappeared.
+            **pipeline_kwargs: Batch size and concurrency options passed to IngestPipeline,
+                plus vector_dtype ("FLOAT32", "FLOAT16" or "INT8"), rescore,
+                dimensions, filter_fields, backend ("redis" or "pgvector") and
+                backend_options for new indexes.
 
         Returns:
             Redis: An instance of the Redis class containing the loaded documents.
         """
-        docs = []
-        for filepath in filepaths:
-            loader = get_loader_from_file(filepath)
-            docs.extend(loader.load())
+        # 建流水线时会同步读写索引配置，放到线程中执行
+        pipeline = await asyncio.to_thread(
+            RedisRag._create_pipeline, indexname, splitlen=splitlen, **pipeline_kwargs
+        )
+        return await pipeline.run(filepaths, metadatas, sync=sync)
 
-        if metadatas:
-            for doc in docs:
-                if not doc.metadata:
-                    doc.metadata = {}
-                doc.metadata.update(metadatas.pop(0))
+    @staticmethod
+    def from_files(
+        indexname: str,
+        filepaths: List[str],
+        splitlen: int = 1024,
+        metadatas: List[dict] = None,
+        sync: bool = False,
+        **pipeline_kwargs,
+    ):
+        """
+        Synchronous wrapper of afrom_files for scripts. Blocks the calling thread;
+        when called inside a running event loop the pipeline runs on a separate
+        thread, so coroutines should await afrom_files instead.
 
-        splitter = RecursiveCharacterTextSplitter(
-            chunk_size=splitlen, chunk_overlap=0, length_function=tokens_len
-        )
-        spdocs = splitter.split_documents(docs)
-        if not spdocs:
-            raise ValueError("No documents were loaded from the provided filepaths.")
+        Args:
+            indexname (str): The name of the index.
+            filepaths (List[str]): A list of filepaths to load documents from.
+            splitlen (int, optional): The length to split the documents into. Defaults to 1024.
+            metadatas (List[dict], optional): Metadata for each file, in the same order as filepaths.
+            sync (bool, optional): Treat filepaths as the full corpus and delete chunks that disappeared.
 
-        return Redis.from_documents(
-            spdocs,
-            OpenAIEmbeddings(model=RedisRag.embedding_model),
-            redis_url=os.environ["REDIS_URL"],
-            index_name=indexname,
+        Returns:
+            Redis: An instance of the Redis class containing the loaded documents.
+        """
+        return _run_sync(
+            lambda: RedisRag.afrom_files(
+                indexname, filepaths, splitlen, metadatas, sync, **pipeline_kwargs
+            )
         )
 
     @staticmethod
-    def get_vectordb(index_name=None):
-        vector_schema = {
-            "algorithm": "HNSW",
-            "distance_metric": "cosine",
-            "metadata_keys": ["blob_name", "blob_uri"],
-        }
-        return Redis(
+    def _create_vectordb(index_name=None):
+        config = RedisRag.get_index_config(index_name, ttl=0)
+        vdb = Redis(
             redis_url=os.environ["REDIS_URL"],
             index_name=index_name,
-            vector_schema=vector_schema,
-            embedding=OpenAIEmbeddings(model=RedisRag.embedding_model),
+            index_schema=config.metadata_schema,
+            vector_schema=RedisRag.vector_schema,
+            embedding=get_query_embeddings(RedisRag.embedding_model, config.dimensions),
+            key_prefix=index_key_prefix(index_name),
         )
+        # 替换为共享连接池上的客户端，避免每个索引各持一条连接
+        bootstrap_client, vdb.client = vdb.client, get_redis_client()
+        bootstrap_client.close()
+        return vdb
 
     @staticmethod
-    def drop_index(index_name=None):
-        return Redis.drop_index(
-            redis_url=os.environ["REDIS_URL"],
-            index_name=index_name,
-            delete_documents=True,
+    def get_vectordb(index_name=None) -> Redis:
+        """
+        返回 Redis 索引的向量库实例。不在 Redis 中的索引抛出 ValueError，
+        这类索引通过 get_store 或 asimilarity_search / ahybrid_search 检索。
+        """
+        config = RedisRag.get_index_config(index_name)
+        if config.backend != "redis":
+            raise ValueError(
+                f"Index {index_name} lives on {config.backend}, "
+                f"use get_store or asimilarity_search / ahybrid_search"
+            )
+        physical_name = RedisRag.resolve_index(index_name)
+        return vectordb_registry.get(
+            physical_name, lambda: RedisRag._create_vectordb(physical_name), config.revision
+        )
+
+    @staticmethod
+    def _search_target(index_name: str):
+        """
+        检索前的同步准备：读取索引配置、创建外部向量库、解析物理索引。
+        别名和配置缓存过期时会同步读 Redis，协程中应通过 asyncio.to_thread 调用。
+
+        Returns:
+            tuple: (IndexConfig, 外部向量库或 None, 物理索引名称)。
+        """
+        config = RedisRag.get_index_config(index_name)
+        store = RedisRag.get_store(index_name, config)
+        return config, store, RedisRag.resolve_index(index_name)
+
+    @staticmethod
+    async def asimilarity_search(
+        index_name: str, query: str, k: int = 4, filters: List[dict] = None
+    ) -> List[Tuple[Document, float]]:
+        """
+        KNN 检索，已启用本地快照（LOCAL_INDEXES）的索引在进程内检索，其余走 Redis。
+        带过滤条件的查询总是走 Redis，在 KNN 内部预过滤。
+
+        Args:
+            index_name (str): 索引名称。
+            query (str): 查询文本。
+            k (int, optional): 返回条数。
+            filters (List[dict], optional): 元数据过滤条件，见 build_filter_expression。
+
+        Returns:
+            List[Tuple[Document, float]]: (文档, 相关度) 列表。
+        """
+        config, store, physical_name = await asyncio.to_thread(RedisRag._search_target, index_name)
+        vector = await RedisRag.aembed_query(index_name, query, config)
+        if store is not None:
+            return await store.search_by_vector(vector, k, filters)
+        local = get_local_index(index_name, physical_name)
+        if local is not None and not config.needs_codebook:
+            local.schedule_refresh(get_redis_client(), config.decode)
+            if local.ready and not filters:
+                return await asyncio.to_thread(local.search_by_vector, vector, k)
+        return await asyncio.to_thread(
+            RedisRag.search_by_vector, index_name, vector, k, config, filters
         )
+
+    @staticmethod
+    async def aembed_query(index_name: str, query: str, config: IndexConfig = None) -> List[float]:
+        """按索引声明的维度嵌入查询文本，维度不一致时抛出 ValueError。"""
+        config = config or await asyncio.to_thread(RedisRag.get_index_config, index_name)
+        embeddings = get_query_embeddings(RedisRag.embedding_model, config.dimensions)
+        vector = await embeddings.aembed_query(query)
+        config.check_dimensions(vector, index_name)
+        return vector
+
+    @staticmethod
+    async def aembed_queries(items: List[Tuple[str, str]]) -> List[List[float]]:
+        """
+        批量嵌入多个 (索引, 查询) 对。按索引声明的维度分组，每组未缓存的查询合并为一次嵌入请求，
+        结果写入查询向量缓存，后续 aembed_query 直接命中。
+
+        Args:
+            items (List[Tuple[str, str]]): (索引名称, 查询文本) 列表。
+
+        Returns:
+            List[List[float]]: 与输入一一对应的查询向量。
+        """
+        groups: Dict[int, List[int]] = {}
+        configs = await asyncio.to_thread(
+            lambda: [RedisRag.get_index_config(index_name) for index_name, _ in items]
+        )
+        for i, config in enumerate(configs):
+            groups.setdefault(config.dimensions, []).append(i)
+        vectors: List[List[float]] = [None] * len(items)
+        for dimensions, positions in groups.items():
+            embeddings = get_query_embeddings(RedisRag.embedding_model, dimensions)
+            result = await embeddings.aembed_queries([items[i][1] for i in positions])
+            for i, vector in zip(positions, result):
+                configs[i].check_dimensions(vector, items[i][0])
+                vectors[i] = vector
+        return vectors
+
+    @staticmethod
+    def search_by_vector(
+        index_name: str,
+        vector: List[float],
+        k: int,
+        config: IndexConfig = None,
+        filters: List[dict] = None,
+    ) -> List[Tuple[Document, float]]:
+        """
+        按索引配置编码查询向量并执行 KNN 检索，支持 FLOAT32 / FLOAT16 / INT8。
+        开启 rescore 时召回 4k 个候选，用原始精度查询向量重新计算余弦相似度后取前 k 个。
+        INT8 索引使用内积距离，未开启 rescore 时也按解码后的向量计算余弦相似度作为得分。
+        过滤条件作为 KNN 的预过滤表达式执行。只适用于 Redis 索引，见 get_vectordb。
+        """
+        config = config or RedisRag.get_index_config(index_name)
+        if config.needs_codebook:
+            # 调用方持有的可能是 codebook 写入前的配置，重新读取
+            config = RedisRag.get_index_config(index_name, ttl=0)
+            if config.needs_codebook:
+                # 还没有写入任何向量
+                return []
+        vdb = RedisRag.get_vectordb(index_name)
+        schema = vdb._schema
+        fetch_k = k * 4 if config.rescore else k
+        with_vectors = config.rescore or config.vector_dtype == "INT8"
+        prefilter = build_filter_expression(filters, config, index_name)
+        redis_query = (
+            Query(f"{prefilter}=>[KNN {fetch_k} @{schema.content_vector_key} $vector AS distance]")
+            .sort_by("distance")
+            .return_fields(schema.content_key, "distance", *schema.metadata_keys)
+            .paging(0, fetch_k)
+            .dialect(2)
+        )
+        if with_vectors:
+            redis_query.return_field(schema.content_vector_key, decode_field=False)
+        results = vdb.client.ft(vdb.index_name).search(
+            redis_query, query_params={"vector": config.encode_query(vector)}
+        )
+        candidates = []
+        for result in results.docs:
+            metadata = {"id": result.id}
+            metadata.update({key: getattr(result, key) for key in schema.metadata_keys if hasattr(result, key)})
+            doc = Document(page_content=getattr(result, schema.content_key, ""), metadata=metadata)
+            candidates.append(
+                (doc, 1 - float(result.distance), getattr(result, schema.content_vector_key, None))
+            )
+        if config.rescore:
+            return rescore(vector, [c for c in candidates if c[2]], config, k)
+        if with_vectors:
+            # 量化内积不是余弦相似度，按解码向量归一化得分
+            return rescore(vector, [c for c in candidates[:k] if c[2]], config, k)
+        return [(doc, score) for doc, score, _ in candidates[:k]]
+
+    @staticmethod
+    def text_search(
+        index_name: str, query: str, k: int = 4, filters: List[dict] = None
+    ) -> List[Tuple[Document, float]]:
+        """
+        在 Redis 索引的 content 字段上做 BM25 全文检索，pgvector 索引使用 PgVectorStore.text_search。
+
+        Args:
+            index_name (str): 索引名称。
+            query (str): 查询文本，按词切分后以 OR 方式匹配。
+            k (int, optional): 返回条数。
+            filters (List[dict], optional): 元数据过滤条件。
+
+        Returns:
+            List[Tuple[Document, float]]: (文档, BM25 得分) 列表。
+        """
+        terms = [_token_escaper.escape(t) for t in re.findall(r"\w+", query)]
+        if not terms:
+            return []
+        vdb = RedisRag.get_vectordb(index_name)
+        content_key = vdb._schema.content_key
+        metadata_keys = vdb._schema.metadata_keys
+        expression = f"@{content_key}:({'|'.join(terms)})"
+        if filters:
+            config = RedisRag.get_index_config(index_name)
+            expression = f"{expression} {build_filter_expression(filters, config, index_name)}"
+        redis_query = (
+            Query(expression)
+            .scorer("BM25")
+            .with_scores()
+            .return_fields(content_key, *metadata_keys)
+            .paging(0, k)
+            .dialect(2)
+        )
+        results = vdb.client.ft(vdb.index_name).search(redis_query)
+        docs = []
+        for result in results.docs:
+            metadata = {"id": result.id}
+            metadata.update({key: getattr(result, key) for key in metadata_keys if hasattr(result, key)})
+            docs.append(
+                (Document(page_content=getattr(result, content_key, ""), metadata=metadata), float(result.score))
+            )
+        return docs
+
+    @staticmethod
+    async def ahybrid_search(
+        index_name: str,
+        query: str,
+        k: int = 4,
+        vector_weight: float = 1.0,
+        text_weight: float = 1.0,
+        fetch_k: int = None,
+        rrf_k: int = 60,
+        filters: List[dict] = None,
+    ) -> List[Tuple[Document, float]]:
+        """
+        并发执行 KNN 向量检索和 BM25 全文检索，并用加权 RRF 融合。
+
+        Args:
+            index_name (str): 索引名称。
+            query (str): 查询文本。
+            k (int, optional): 最终返回条数。
+            vector_weight (float, optional): 向量检索结果的权重。
+            text_weight (float, optional): 全文检索结果的权重。
+            fetch_k (int, optional): 每一路召回条数，默认为 max(k * 4, 20)。
+            rrf_k (int, optional): RRF 平滑常数。
+            filters (List[dict], optional): 元数据过滤条件，两路检索都会应用。
+
+        Returns:
+            List[Tuple[Document, float]]: (文档, 融合得分) 列表。
+        """
+        fetch_k = fetch_k or max(k * 4, 20)
+        _, store, _ = await asyncio.to_thread(RedisRag._search_target, index_name)
+        if store is not None:
+            text_search = store.text_search(query, fetch_k, filters)
+        else:
+            text_search = asyncio.to_thread(RedisRag.text_search, index_name, query, fetch_k, filters)
+        vector_results, text_results = await asyncio.gather(
+            RedisRag.asimilarity_search(index_name, query, k=fetch_k, filters=filters),
+            text_search,
+        )
+        fused = reciprocal_rank_fusion(
+            [vector_results, text_results], [vector_weight, text_weight], k=rrf_k
+        )
+        return fused[:k]
+
+    @staticmethod
+    async def arebuild_index(
+        index_name: str,
+        filepaths: List[str],
+        splitlen: int = 1024,
+        metadatas: List[dict] = None,
+        probe_queries: List[str] = None,
+        gc_delay: float = 30,
+        **pipeline_kwargs,
+    ) -> str:
+        """
+        零停机重建索引：在新的物理索引中入库，用探测查询预热后原子切换别名，
+        再在 gc_delay 秒后分批回收旧版本的键。重建期间查询始终落在旧版本上。
+
+        Args:
+            index_name (str): 逻辑索引名称。
+            filepaths (List[str]): 文件路径列表。
+            splitlen (int, optional): 切分长度。
+            metadatas (List[dict], optional): 与 filepaths 一一对应的元数据。
+            probe_queries (List[str], optional): 切换前在新版本上执行的预热查询。
+            gc_delay (float, optional): 切换后等待多久再回收旧版本，留给其他 worker 刷新别名缓存。
+            **pipeline_kwargs: 传给 IngestPipeline 的参数，未指定的向量类型、维度和过滤字段沿用旧版本。
+
+        Returns:
+            str: 新的物理索引名称。
+        """
+        client = get_redis_client()
+        old_name = await asyncio.to_thread(resolve_index, client, index_name, 0)
+        old_config = await asyncio.to_thread(IndexConfig.load, client, old_name, 0)
+        pipeline_kwargs.setdefault("vector_dtype", old_config.vector_dtype)
+        pipeline_kwargs.setdefault("rescore", old_config.rescore)
+        pipeline_kwargs.setdefault("dimensions", old_config.dimensions)
+        pipeline_kwargs.setdefault("filter_fields", old_config.filter_fields)
+        pipeline_kwargs.setdefault("backend", old_config.backend)
+        pipeline_kwargs.setdefault("backend_options", old_config.backend_options)
+        physical_name = versioned_index_name(index_name)
+        try:
+            await RedisRag.afrom_files(
+                physical_name, filepaths, splitlen, metadatas, **pipeline_kwargs
+            )
+            for query in probe_queries or []:
+                if not await RedisRag.asimilarity_search(physical_name, query, k=1):
+                    log.warning(f"probe query returned nothing on {physical_name}: {query}")
+        except BaseException:
+            await asyncio.to_thread(RedisRag.gc_index, physical_name)
+            raise
+        old_name = await asyncio.to_thread(set_index_alias, client, index_name, physical_name)
+        log.info(f"index {index_name} switched from {old_name} to {physical_name}")
+        if old_name != physical_name:
+            await asyncio.sleep(gc_delay)
+            await asyncio.to_thread(RedisRag.gc_index, old_name)
+        return physical_name
+
+    @staticmethod
+    def gc_index(physical_name: str, batch_size: int = 500, interval: float = 0.05):
+        """
+        回收物理索引：先删除索引定义，再按批 UNLINK 文档键，每批之间暂停 interval 秒以限制对 Redis 的压力。
+        """
+        client = get_redis_client()
+        store = RedisRag.get_store(physical_name, IndexConfig.load(client, physical_name, ttl=0))
+        if store is not None:
+            store.drop_sync()
+        else:
+            try:
+                client.ft(physical_name).dropindex(delete_documents=False)
+            except redis.ResponseError as e:
+                log.warning(f"drop index {physical_name}: {e}")
+        vectordb_registry.invalidate(physical_name)
+        release_local_index(physical_name)
+        batch = []
+        for key in client.scan_iter(match=f"{index_key_prefix(physical_name)}:*", count=batch_size):
+            batch.append(key)
+            if len(batch) >= batch_size:
+                client.unlink(*batch)
+                batch = []
+                time.sleep(interval)
+        if batch:
+            client.unlink(*batch)
+        # 切换别名后旧版本的结果缓存已不可达，直接删除
+        retire_index_results(client, physical_name, get_index_version(client, physical_name), grace=0)
+        client.unlink(f"ragfp:{physical_name}", f"ragver:{physical_name}")
+        IndexConfig.delete(client, physical_name)
+        log.info(f"index {physical_name} garbage collected")
+
+    @staticmethod
+    def _forget_index(client: redis.Redis, index_name: str, physical_name: str):
+        vectordb_registry.invalidate(physical_name)
+        release_local_index(physical_name)
+        client.unlink(f"ragfp:{physical_name}")
+        IndexConfig.delete(client, physical_name)
+        bump_index_version(client, physical_name)
+        if physical_name != index_name:
+            delete_index_alias(client, index_name)
+
+    @staticmethod
+    def drop_index(index_name=None):
+        """
+        删除索引及其文档，成功后再清除索引配置、指纹集合和别名；删除失败时保留这些信息以便重试。
+        pgvector 索引不能在事件循环中同步删除，协程中请使用 adrop_index。
+        """
+        client = get_redis_client()
+        physical_name = resolve_index(client, index_name, ttl=0)
+        store = RedisRag.get_store(physical_name, IndexConfig.load(client, physical_name, ttl=0))
+        if store is not None:
+            store.drop_sync()
+            dropped = True
+        else:
+            # langchain 吞掉删除失败的异常并返回 False，索引仍存在时视为失败
+            dropped = Redis.drop_index(
+                redis_url=os.environ["REDIS_URL"],
+                index_name=physical_name,
+                delete_documents=True,
+            )
+            if not dropped and check_index_exists(client, physical_name):
+                return False
+        RedisRag._forget_index(client, index_name, physical_name)
+        return dropped
+
+    @staticmethod
+    async def adrop_index(index_name=None):
+        """drop_index 的异步版本，pgvector 索引在当前事件循环的连接池上删除表。"""
+        client = get_redis_client()
+        physical_name = await asyncio.to_thread(resolve_index, client, index_name, 0)
+        config = await asyncio.to_thread(IndexConfig.load, client, physical_name, 0)
+        if config.backend == "redis":
+            return await asyncio.to_thread(RedisRag.drop_index, index_name)
+        store = PgVectorStore(physical_name, config.backend_options, config.filter_fields)
+        await store.drop()
+        await asyncio.to_thread(RedisRag._forget_index, client, index_name, physical_name)
+        return True
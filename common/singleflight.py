@@ -0,0 +1,62 @@
+import asyncio
+from typing import Any, Awaitable, Callable, Dict
+
+
+class _Call:
+    def __init__(self, task: asyncio.Task):
+        self.task = task
+        self.waiters = 0
+
+
+class SingleFlight:
+    """
+    合并并发的相同请求：同一个键同时只有一次上游调用，其余调用方等待同一个结果。
+
+    上游调用在独立的任务中执行，某个调用方被取消（如客户端断开）不会影响其他调用方；
+    只有当所有调用方都已取消时才取消上游调用。
+    """
+
+    def __init__(self):
+        self._calls: Dict[str, _Call] = {}
+        self.counters = {"calls": 0, "coalesced": 0, "cancelled": 0}
+
+    async def do(self, key: str, fn: Callable[[], Awaitable[Any]]) -> Any:
+        """
+        执行 fn 或等待进行中的同键调用。
+
+        Args:
+            key (str): 请求键，相同的键视为相同请求。
+            fn (Callable[[], Awaitable]): 发起上游调用的协程函数。
+
+        Returns:
+            Any: 上游调用的结果，异常会传给所有调用方。
+        """
+        call = self._calls.get(key)
+        if call is None:
+            call = _Call(asyncio.create_task(fn()))
+            self._calls[key] = call
+            call.task.add_done_callback(lambda task: self._done(key, call))
+            self.counters["calls"] += 1
+        else:
+            self.counters["coalesced"] += 1
+        call.waiters += 1
+        try:
+            return await asyncio.shield(call.task)
+        finally:
+            call.waiters -= 1
+            if call.waiters == 0 and not call.task.done():
+                # 先移除键，取消回调执行前到达的相同请求会发起新的调用，而不是等待已取消的任务
+                if self._calls.get(key) is call:
+                    del self._calls[key]
+                call.task.cancel()
+                self.counters["cancelled"] += 1
+
+    def _done(self, key: str, call: _Call):
+        if self._calls.get(key) is call:
+            del self._calls[key]
+        if not call.task.cancelled():
+            # 所有调用方都已离开时，避免 "exception was never retrieved" 警告
+            call.task.exception()
+
+    def stats(self) -> dict:
+        return dict(self.counters, in_flight=len(self._calls))
@@ -2,9 +2,9 @@ from datetime import timedelta
 from typing import List
 import uuid
 from pydub import AudioSegment
-from openai import AzureOpenAI, AsyncAzureOpenAI
 from pydub import AudioSegment
 from common.utils import get_global_datadir
+from common.aoaiclient import openai_clients
 import azure.cognitiveservices.speech as speechsdk
 from xml.etree import ElementTree
 from multiprocessing import Pool
@@ -105,10 +105,10 @@ def generate_openai_speech_segment(
     返回:
     AudioSegment: 生成的语音片段。
     """
-    client = AzureOpenAI(
+    client = openai_clients.get_sync(
         api_key=os.getenv("TTS_AZURE_OPENAI_API_KEY"),
         api_version=os.getenv("TTS_AZURE_OPENAI_API_VERSION"),
-        azure_endpoint=os.getenv("TTS_AZURE_OPENAI_ENDPOINT"),
+        endpoint=os.getenv("TTS_AZURE_OPENAI_ENDPOINT"),
     )
     with client.audio.speech.with_streaming_response.create(
         model="tts-1", voice=voice, input=text, speed=speed
@@ -132,10 +132,10 @@ async def agenerate_openai_speech_file(text, voice: str = "onyx", speed=1.0) ->
     返回:
     str: 生成的语音文件。
     """
-    client = AsyncAzureOpenAI(
+    client = openai_clients.get_async(
         api_key=os.getenv("TTS_AZURE_OPENAI_API_KEY"),
         api_version=os.getenv("TTS_AZURE_OPENAI_API_VERSION"),
-        azure_endpoint=os.getenv("TTS_AZURE_OPENAI_ENDPOINT"),
+        endpoint=os.getenv("TTS_AZURE_OPENAI_ENDPOINT"),
     )
     filename = os.path.join(
         get_global_datadir("temp_speech"), uuid.uuid4().hex + ".mp3"
@@ -346,10 +346,10 @@ def generate_openai_transcribe(
     - transcript：生成的转录文本。
 
     """
-    client = AzureOpenAI(
+    client = openai_clients.get_sync(
         api_key=os.getenv("WHISPER_AZURE_OPENAI_API_KEY"),
         api_version=os.getenv("WHISPER_AZURE_OPENAI_API_VERSION"),
-        azure_endpoint=os.getenv("WHISPER_AZURE_OPENAI_ENDPOINT"),
+        endpoint=os.getenv("WHISPER_AZURE_OPENAI_ENDPOINT"),
     )
     transcript = client.audio.transcriptions.create(
         model="whisper",
@@ -375,10 +375,10 @@ async def agenerate_openai_transcribe(
 
     异步函数。
     """
-    client = AsyncAzureOpenAI(
+    client = openai_clients.get_async(
         api_key=os.getenv("WHISPER_AZURE_OPENAI_API_KEY"),
         api_version=os.getenv("WHISPER_AZURE_OPENAI_API_VERSION"),
-        azure_endpoint=os.getenv("WHISPER_AZURE_OPENAI_ENDPOINT"),
+        endpoint=os.getenv("WHISPER_AZURE_OPENAI_ENDPOINT"),
     )
     prompt = _transcribe_prompts.get(format)
     if prompt_text:
@@ -2,10 +2,11 @@ import json
 import re
 import sys
 import uuid
+import shutil
 import traceback
 import aiofiles
 
-from common.rediscache import RedisCache
+from common.rediscache import NAMESPACE_TTLS, CacheCodec, TieredCache
 from common.translate import get_translate
 
 try:
@@ -16,7 +17,7 @@ except:
 
 import logging
 import os
-from fastapi import FastAPI, Depends, File, Form, HTTPException, UploadFile
+from fastapi import FastAPI, Depends, File, Form, Header, HTTPException, UploadFile
 from fastapi.responses import FileResponse
 from fastapi.security import APIKeyHeader
 from pydantic import BaseModel, Field
@@ -31,15 +32,29 @@ from fastapi.templating import Jinja2Templates
 from fastapi import FastAPI, Request, HTTPException
 from fastapi.responses import StreamingResponse
 from pydantic import BaseModel, Field
-from typing import Any, Dict, Optional, Union
+from typing import Any, Dict, List, Literal, Optional, Union
 import asyncio
 
-from common.redisrag import RedisRag, tokens_len
+from common.redisrag import (
+    RedisRag,
+    aclose_shared_embeddings,
+    get_redis_client,
+    tokens_len,
+    tokens_len_batch,
+    truncate_tokens,
+)
+from common.embedcache import embedding_cache
+from common.indexconfig import FilterError
+from common.ragcache import rag_cache_key, semantic_result_index, track_rag_result
+from common.ingestjob import IngestJob
+from common.pgvector import close_pg_pool
+from common.aoaiclient import openai_clients
+from common.llmcache import LLMResponseCache, llm_cache_enabled, llm_cache_key
+from common.llmrouter import llm_router
 
 
 
 from common.utils import (
-    md5hash,
     validate_api_key,
 )
 from common.openai import (
@@ -47,6 +62,8 @@ from common.openai import (
     openai_async_json_generate,
     openai_analyze_image,
     openai_agenerate_image,
+    llm_singleflight,
+    llm_hedge,
 )
 
 log_formatter = logging.Formatter(
@@ -89,7 +106,7 @@ app = FastAPI(
     description="gptservice api",
     version="1.0.0",
     docs_url=None, 
-    redoc_url=None
+    redoc_url=None,
     servers=[
         {"url": os.environ.get("GPTS_API_SERVER"), "description": "Production server"},
         {"url": "http://0.0.0.0:8700", "description": "Develop server"},
@@ -102,7 +119,16 @@ executor = ProcessPoolExecutor()
 
 templates = Jinja2Templates(directory="templates")
 
-cache = RedisCache(os.environ.get("REDIS_URL"))
+cache = TieredCache(
+    os.environ.get("REDIS_URL"),
+    codec=CacheCodec(threshold=int(os.environ.get("CACHE_COMPRESS_THRESHOLD", 1024))),
+    max_bytes=int(os.environ.get("CACHE_LOCAL_MAX_BYTES", 64 * 1024 * 1024)),
+)
+rag_cache = cache.namespace("rag")
+llm_cache = LLMResponseCache(
+    cache.namespace("llm"),
+    max_bytes=int(os.environ.get("LLM_CACHE_MAX_BYTES", 256 * 1024)),
+)
 
 
 async def run_in_process(fn, *args):
@@ -110,6 +136,14 @@ async def run_in_process(fn, *args):
     return await loop.run_in_executor(executor, fn, *args)
 
 
+@app.on_event("shutdown")
+async def shutdown():
+    await cache.close()
+    await close_pg_pool()
+    await openai_clients.aclose()
+    await aclose_shared_embeddings()
+
+
 class TokenData(BaseModel):
     api_key: str
 
@@ -190,10 +224,118 @@ async def root(request: Request):
     return templates.TemplateResponse("privacy.html", {"request": request})
 
 
+class RagFilter(BaseModel):
+    field: str = Field(..., description="Indexed metadata field, e.g. blob_name")
+    op: str = Field("eq", description="'eq', 'in' or 'prefix' for tag fields, 'range' for numeric fields")
+    value: Union[str, List[str], None] = Field(None, description="Tag value, or a list of values for 'in'")
+    min: Optional[float] = Field(None, description="Lower bound for 'range', inclusive")
+    max: Optional[float] = Field(None, description="Upper bound for 'range', inclusive")
+
+
 class RagQuery(BaseModel):
     index: str
     query: str
     topk: int = 2
+    mode: Literal["vector", "hybrid"] = Field(
+        "vector",
+        description="Retrieval mode: 'vector' for KNN only, 'hybrid' for KNN + BM25 full-text with rank fusion",
+    )
+    vector_weight: float = Field(1.0, description="Weight of the KNN results in hybrid mode")
+    text_weight: float = Field(1.0, description="Weight of the full-text results in hybrid mode")
+    filters: List[RagFilter] = Field(
+        [], description="Metadata filters applied before KNN ranking, combined with AND"
+    )
+    max_tokens: Optional[int] = Field(
+        None,
+        gt=0,
+        description="Token budget: pack the highest-scoring of the topk chunks until it is reached, "
+        "a chunk that does not fit is truncated and marked, or skipped if too little budget is left",
+    )
+
+
+async def rag_retrieve(query: RagQuery):
+    filters = [f.model_dump() for f in query.filters]
+    if query.mode == "hybrid":
+        return await RedisRag.ahybrid_search(
+            query.index,
+            query.query,
+            k=query.topk,
+            vector_weight=query.vector_weight,
+            text_weight=query.text_weight,
+            filters=filters,
+        )
+    return await RedisRag.asimilarity_search(
+        query.index, query.query, k=query.topk, filters=filters
+    )
+
+
+# 语义结果缓存默认关闭：只差一个精确词（错误码、型号、版本号）的查询嵌入后也可能非常接近
+RAG_SEMANTIC_CACHE_DISTANCE = float(os.environ.get("RAG_SEMANTIC_CACHE_DISTANCE", 0))
+
+
+def rag_cache_scope(query: RagQuery, version: str) -> str:
+    """结果缓存的作用域：索引、索引版本和全部检索参数。"""
+    return "|".join(
+        str(v)
+        for v in (
+            query.index,
+            version,
+            query.mode,
+            query.topk,
+            query.vector_weight,
+            query.text_weight,
+            json.dumps([f.model_dump() for f in query.filters], sort_keys=True),
+            query.max_tokens,
+        )
+    )
+
+
+def rag_search_result(data: list, datastr: str, cachekey: str, cached: bool = False):
+    source = f"{os.getenv('GPTS_API_SERVER')}/api/knowledge/cache/{cachekey}"
+    return RestResult(
+        code=0,
+        msg="ok",
+        result=dict(
+            data=data, tokens=tokens_len(datastr), source_url=source, cached=cached
+        ),
+    )
+
+
+def rag_result_data(result, max_tokens: int = None) -> list:
+    data = []
+    for r in result:
+        item = r[0].model_dump()
+        item["score"] = r[1]
+        data.append(item)
+    if max_tokens is not None:
+        data = rag_pack_data(data, max_tokens)
+    return data
+
+
+RAG_MIN_TRUNCATED_TOKENS = 32
+
+
+def rag_pack_data(data: list, max_tokens: int) -> list:
+    """
+    按得分从高到低贪心装入文本块，直到用完令牌预算。
+    装不下的文本块在剩余预算不少于 RAG_MIN_TRUNCATED_TOKENS 时截断到剩余预算后放入并标记 truncated，
+    否则跳过它，继续尝试排在后面、能完整放下的较短文本块。
+    """
+    lengths = tokens_len_batch([item["page_content"] for item in data])
+    packed, remaining = [], max_tokens
+    for item, length in sorted(zip(data, lengths), key=lambda x: -x[0]["score"]):
+        if remaining <= 0:
+            break
+        if length <= remaining:
+            item.update(tokens=length, truncated=False)
+            packed.append(item)
+            remaining -= length
+        elif remaining >= RAG_MIN_TRUNCATED_TOKENS:
+            item["page_content"] = truncate_tokens(item["page_content"], remaining)
+            item.update(tokens=remaining, truncated=True)
+            packed.append(item)
+            remaining = 0
+    return packed
 
 
 @app.api_route(
@@ -208,31 +350,42 @@ async def redis_rag_search(
 ):
     """Search the knowledge base to return relevant content"""
     try:
-        cachekey = f"rag_{md5hash(query.query)}"
-        vdb = RedisRag.get_vectordb(query.index)
-        result = await vdb.asimilarity_search_with_relevance_scores(
-            query.query, k=query.topk, return_metadata=True
-        )
+        version = await asyncio.to_thread(RedisRag.get_index_version, query.index)
+        scope = rag_cache_scope(query, version)
+        cachekey = rag_cache_key(scope, query.query)
+        datastr = await rag_cache.get(cachekey)
+        vector = None
+        # 混合检索依赖精确词匹配，只有纯向量检索使用语义层
+        semantic = RAG_SEMANTIC_CACHE_DISTANCE > 0 and query.mode == "vector"
+        if datastr is None and semantic:
+            vector = await RedisRag.aembed_query(query.index, query.query)
+            similar_key = semantic_result_index.lookup(
+                scope, vector, RAG_SEMANTIC_CACHE_DISTANCE
+            )
+            if similar_key:
+                datastr = await rag_cache.get(similar_key)
+                cachekey = similar_key if datastr is not None else cachekey
+        if datastr is not None:
+            return rag_search_result(json.loads(datastr), datastr, cachekey, cached=True)
+
+        result = await rag_retrieve(query)
         if not result:
             return RestResult(
                 result={},
                 code=200,
                 msg="ok",
             )
-        data = []
-        for r in result:
-            item = r[0].model_dump()
-            item["score"] = r[1]
-            data.append(item)
-
-        datastr = json.dumps(data, ensure_ascii=False, indent=4)
-        cache.set_cache(cachekey, datastr, expire=3600 * 24 * 365)
-        source = f"{os.getenv('GPTS_API_SERVER')}/api/knowledge/cache/{cachekey}"
-        return RestResult(
-            code=0,
-            msg="ok",
-            result=dict(data=data, tokens=tokens_len(datastr), source_url=source),
-        )
+        data = await asyncio.to_thread(rag_result_data, result, query.max_tokens)
+        datastr = json.dumps(data, ensure_ascii=False)
+        if await rag_cache.set(cachekey, datastr):
+            await track_rag_result(
+                cache.client, version, await rag_cache.full_key(cachekey), rag_cache.ttl
+            )
+        if vector is not None:
+            semantic_result_index.add(scope, vector, cachekey)
+        return rag_search_result(data, datastr, cachekey)
+    except FilterError as e:
+        raise HTTPException(status_code=400, detail=str(e))
     except Exception as e:
         import traceback
 
@@ -240,6 +393,207 @@ async def redis_rag_search(
         raise HTTPException(status_code=500, detail=str(e))
 
 
+class RagBatchQuery(BaseModel):
+    queries: List[RagQuery] = Field(..., description="The queries to run, results are returned in the same order")
+    dedup: bool = Field(
+        False, description="Drop chunks already returned for an earlier query in the batch"
+    )
+
+
+@app.post(
+    "/api/knowledge/query/batch",
+    summary="batch query the knowledge base",
+    description="run several knowledge base queries with one embedding request",
+)
+async def redis_rag_batch_search(
+    batch: RagBatchQuery,
+    td: TokenData = Depends(verify_api_key),
+):
+    """Search the knowledge base for several queries at once"""
+    try:
+        # 一次嵌入请求预热查询向量缓存，之后各查询并发检索
+        await RedisRag.aembed_queries([(q.index, q.query) for q in batch.queries])
+        results = await asyncio.gather(*[rag_retrieve(q) for q in batch.queries])
+        seen = set()
+        items = []
+        for query, result in zip(batch.queries, results):
+            data = rag_result_data(result or [])
+            if batch.dedup:
+                data = [d for d in data if d["metadata"].get("id") not in seen]
+            if query.max_tokens is not None:
+                data = rag_pack_data(data, query.max_tokens)
+            if batch.dedup:
+                seen.update(d["metadata"].get("id") for d in data)
+            datastr = json.dumps(data, ensure_ascii=False)
+            items.append(dict(data=data, tokens=tokens_len(datastr)))
+        return RestResult(code=0, msg="ok", result=dict(data=items))
+    except FilterError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+    except Exception as e:
+        traceback.print_exc()
+        raise HTTPException(status_code=500, detail=str(e))
+
+
+@app.get(
+    "/api/knowledge/stats",
+    summary="knowledge query cache stats",
+    description="hit/miss counters of the embedding, result and LLM caches, LLM deployment health and hedging",
+    include_in_schema=False,
+)
+async def redis_rag_stats(td: TokenData = Depends(verify_api_key)):
+    return RestResult(
+        code=0,
+        msg="ok",
+        result={
+            "embedding_cache": embedding_cache.stats(),
+            "semantic_result_cache": semantic_result_index.stats(),
+            "result_cache": cache.stats(),
+            "llm_cache": llm_cache.stats(),
+            "llm_singleflight": llm_singleflight.stats(),
+            "llm_router": llm_router.stats(),
+            "llm_hedge": llm_hedge.stats(),
+        },
+    )
+
+
+INGEST_MAX_JOBS = int(os.environ.get("INGEST_MAX_JOBS", 2))
+INGEST_HEARTBEAT_INTERVAL = float(os.environ.get("INGEST_HEARTBEAT_INTERVAL", 15))
+INGEST_JOB_STALE_AFTER = float(os.environ.get("INGEST_JOB_STALE_AFTER", 120))
+ingest_semaphore = asyncio.Semaphore(INGEST_MAX_JOBS)
+ingest_tasks = set()
+
+
+def ingest_filename(filepath: str) -> str:
+    """上传文件的原始文件名，去掉保存时添加的序号前缀。"""
+    return os.path.basename(filepath).split("_", 1)[1]
+
+
+async def run_ingest_job(
+    job: IngestJob,
+    index: str,
+    filepaths: List[str],
+    jobdir: str,
+    splitlen: int,
+    sync: bool,
+    rebuild: bool = False,
+    probe_queries: List[str] = None,
+):
+    """
+    后台执行入库任务，文件解析和切分在进程池中进行，完成后删除上传的文件。
+    排队和执行期间定期刷新任务心跳，worker 退出后任务会被报告为失败。
+    """
+    heartbeat = asyncio.create_task(job.keepalive(INGEST_HEARTBEAT_INTERVAL))
+    try:
+        async with ingest_semaphore:
+            error = None
+            metadatas = [{"blob_name": ingest_filename(f)} for f in filepaths]
+            try:
+                await asyncio.to_thread(job.start)
+                if rebuild:
+                    await RedisRag.arebuild_index(
+                        index,
+                        filepaths,
+                        splitlen,
+                        metadatas,
+                        probe_queries=probe_queries,
+                        executor=executor,
+                        progress_callback=job.progress,
+                    )
+                else:
+                    await RedisRag.afrom_files(
+                        index,
+                        filepaths,
+                        splitlen,
+                        metadatas,
+                        sync=sync,
+                        executor=executor,
+                        progress_callback=job.progress,
+                    )
+            except Exception as e:
+                log.error(f"Ingest job {job.job_id} failed: {e}")
+                traceback.print_exc()
+                error = str(e)
+            finally:
+                await asyncio.to_thread(job.finish, error)
+                shutil.rmtree(jobdir, ignore_errors=True)
+    finally:
+        heartbeat.cancel()
+
+
+@app.post(
+    "/api/knowledge/ingest",
+    summary="upload files into the knowledge base",
+    description="upload files and ingest them into a knowledge index in the background, returns a job id",
+)
+async def redis_rag_ingest(
+    files: List[UploadFile] = File(...),
+    index: str = Form(...),
+    splitlen: int = Form(1024),
+    sync: bool = Form(False),
+    rebuild: bool = Form(
+        False, description="Build a new index version and switch to it when done, queries keep using the old version meanwhile"
+    ),
+    probe_queries: List[str] = Form([], description="Queries used to warm the new version before switching"),
+    td: TokenData = Depends(verify_api_key),
+):
+    """Upload files and enqueue an ingestion job"""
+    job = IngestJob(get_redis_client())
+    jobdir = os.path.join(DATA_DIR, "ingest", job.job_id)
+    os.makedirs(jobdir, exist_ok=True)
+    try:
+        filepaths = []
+        for i, file in enumerate(files):
+            filename = os.path.basename(file.filename or "")
+            if not filename:
+                raise HTTPException(status_code=400, detail="Invalid file name")
+            # 加序号前缀，同一任务中的同名文件不会互相覆盖
+            filepath = os.path.join(jobdir, f"{i}_{filename}")
+            async with aiofiles.open(filepath, "wb") as f:
+                while chunk := await file.read(1024 * 64):
+                    await f.write(chunk)
+            filepaths.append(filepath)
+        await asyncio.to_thread(job.create, index, [ingest_filename(f) for f in filepaths])
+    except Exception:
+        shutil.rmtree(jobdir, ignore_errors=True)
+        raise
+
+    task = asyncio.create_task(
+        run_ingest_job(
+            job, index, filepaths, jobdir, splitlen, sync, rebuild, probe_queries
+        )
+    )
+    ingest_tasks.add(task)
+    task.add_done_callback(ingest_tasks.discard)
+    return RestResult(code=0, msg="ok", result={"job_id": job.job_id})
+
+
+@app.get(
+    "/api/knowledge/ingest/{job_id}",
+    summary="get ingestion job status",
+    description="status and progress counters (files parsed, chunks embedded, chunks written) of an ingestion job",
+)
+async def redis_rag_ingest_status(job_id: str, td: TokenData = Depends(verify_api_key)):
+    data = await asyncio.to_thread(
+        IngestJob.get, get_redis_client(), job_id, INGEST_JOB_STALE_AFTER
+    )
+    if data is None:
+        raise HTTPException(status_code=404, detail="Job not found")
+    return RestResult(code=0, msg="ok", result=data)
+
+
+@app.post(
+    "/api/cache/{namespace}/invalidate",
+    summary="invalidate a cache namespace",
+    description="invalidate every entry of a cache namespace (rag, llm, embeddings)",
+    include_in_schema=False,
+)
+async def cache_invalidate(namespace: str, td: TokenData = Depends(verify_api_key)):
+    if namespace not in NAMESPACE_TTLS:
+        raise HTTPException(status_code=404, detail="Unknown cache namespace")
+    generation = await cache.namespace(namespace).invalidate()
+    return RestResult(code=0, msg="ok", result={"generation": generation})
+
+
 @app.get(
     "/api/knowledge/cache/{haskkey}",
     summary="query the knowledge cache byhash",
@@ -249,7 +603,7 @@ async def redis_rag_search(
 async def redis_rag_cache(haskkey: str, request: Request):
     """fetch the knowledge cache by hash"""
     try:
-        data = cache.get_cache(haskkey)
+        data = await rag_cache.get(haskkey)
         if not data:
             return templates.TemplateResponse(
                 "jsonviewer.html", {"request": request, "data": "cache not found"}
@@ -284,13 +638,34 @@ class TextGenerate(BaseModel):
 )
 async def openai_text_generate_api(
     tg: TextGenerate,
+    http_response: Response,
+    x_llm_cache: Optional[str] = Header(None, description="1 to use the response cache, 0 to bypass it"),
     td: TokenData = Depends(verify_api_key),
 ):
     logging.info("openai_text_generate HTTP trigger function processed a request.")
 
     try:
-        result = await openai_async_text_generate(tg.sysmsg, tg.prompt, tg.model)
-        response = {"data": result, "tokens": tokens_len(result)}
+        use_cache = llm_cache_enabled(tg.temperature, x_llm_cache)
+        cachekey = llm_cache_key(
+            "text", sysmsg=tg.sysmsg, prompt=tg.prompt, model=tg.model, temperature=tg.temperature
+        )
+        cached = await llm_cache.get(cachekey) if use_cache else None
+        if cached is not None:
+            result, usage = cached["content"], cached["usage"]
+        else:
+            result, usage = await openai_async_text_generate(
+                tg.sysmsg, tg.prompt, tg.model, temperature=tg.temperature, with_usage=True
+            )
+            # 空结果和被截断（finish_reason 不是 stop）的结果不缓存
+            if use_cache and result and usage.get("finish_reason", "stop") == "stop":
+                await llm_cache.set(cachekey, result, usage)
+        http_response.headers["X-LLM-Cache"] = "hit" if cached is not None else "miss"
+        response = {
+            "data": result,
+            "tokens": tokens_len(result),
+            "usage": usage,
+            "cached": cached is not None,
+        }
         return RestResult(
             code=0,
             msg="ok",
@@ -326,6 +701,7 @@ class JsonGenerate(BaseModel):
         "gpt-4o",
         description="The model name to be used for text generation. Defaults to 'gpt-4o'.",
     )
+    temperature: Optional[float] = Field(None, description="The temperature, the model default when empty")
 
 @app.api_route(
     "/api/openai/json/generate",
@@ -335,16 +711,41 @@ class JsonGenerate(BaseModel):
 )
 async def openai_json_generate_api(
     tg: JsonGenerate,
+    http_response: Response,
+    x_llm_cache: Optional[str] = Header(None, description="1 to use the response cache, 0 to bypass it"),
     td: TokenData = Depends(verify_api_key),
 ):
     logging.info("openai_json_generate HTTP trigger function processed a request.")
 
     try:
-        result = await openai_async_json_generate(tg.sysmsg, tg.prompt, tg.model, schema=tg.schema)
+        use_cache = llm_cache_enabled(tg.temperature, x_llm_cache)
+        cachekey = llm_cache_key(
+            "json",
+            sysmsg=tg.sysmsg,
+            prompt=tg.prompt,
+            model=tg.model,
+            temperature=tg.temperature,
+            schema=tg.schema,
+        )
+        cached = await llm_cache.get(cachekey) if use_cache else None
+        if cached is not None:
+            result, usage = cached["content"], cached["usage"]
+            data = json.loads(result)
+        else:
+            result, usage = await openai_async_json_generate(
+                tg.sysmsg, tg.prompt, tg.model, schema=tg.schema, temperature=tg.temperature, with_usage=True
+            )
+            # 先解析再缓存，格式错误或被截断的输出不会进入缓存
+            data = json.loads(result)
+            if use_cache:
+                await llm_cache.set(cachekey, result, usage)
+        # 返回体就是模型生成的 JSON，缓存命中情况和用量通过响应头返回
+        http_response.headers["X-LLM-Cache"] = "hit" if cached is not None else "miss"
+        http_response.headers["X-LLM-Usage"] = json.dumps(usage)
         return RestResult(
             code=0,
             msg="ok",
-            result=json.loads(result),
+            result=data,
         )
     except Exception as e:
         return RestResult(
@@ -485,7 +886,12 @@ async def openai_generate_image_api(
 
 # 定义请求模型
 class TokenRequest(BaseModel):
-    content: str = Field("", description="The content to count tokens for")
+    content: Union[str, List[str]] = Field(
+        "", description="The content to count tokens for, a string or a list of strings"
+    )
+    model: Optional[str] = Field(
+        None, description="The model whose tokenizer is used. Defaults to cl100k_base."
+    )
 
 
 @app.post(
@@ -497,7 +903,14 @@ async def openai_stat_token(
     request: TokenRequest, td: TokenData = Depends(verify_api_key)
 ):
     try:
-        length = tokens_len(request.content)
+        if isinstance(request.content, list):
+            lengths = await asyncio.to_thread(
+                tokens_len_batch, request.content, request.model
+            )
+            return RestResult(
+                code=0, msg="ok", result={"data": lengths, "total": sum(lengths)}
+            )
+        length = tokens_len(request.content, request.model)
         return RestResult(code=0, msg="ok", result={"data": length})
     except Exception as e:
         return RestResult(code=500, msg=str(e), result={})
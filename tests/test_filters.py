@@ -0,0 +1,50 @@
+import pytest
+
+redisrag = pytest.importorskip("common.redisrag")
+
+from common.indexconfig import FilterError, IndexConfig  # noqa: E402
+
+CONFIG = IndexConfig(
+    metadata_schema={"tag": [{"name": "blob_name"}], "numeric": [{"name": "page"}], "text": []}
+)
+
+
+def build(filters, config=CONFIG):
+    return redisrag.build_filter_expression(filters, config, "kb")
+
+
+def test_no_filters():
+    assert build([]) == "*"
+
+
+def test_tag_and_range():
+    expression = build(
+        [
+            {"field": "blob_name", "op": "in", "value": ["a.pdf", "b.pdf"]},
+            {"field": "page", "op": "range", "min": 2},
+        ]
+    )
+    assert expression == "(@blob_name:{a\\.pdf|b\\.pdf} @page:[2 +inf])"
+
+
+def test_legacy_index_uses_text_fields():
+    expression = build([{"field": "blob_name", "value": "a.pdf"}], IndexConfig())
+    assert expression == '(@blob_name:("a pdf"))'
+
+
+@pytest.mark.parametrize(
+    "filters",
+    [
+        [{"field": "missing", "value": "x"}],
+        [{"field": "page", "op": "eq", "value": 1}],
+        [{"field": "blob_name", "op": "range", "min": 1}],
+        [{"field": "blob_name", "op": "near", "value": "a.pdf"}],
+        [{"field": "blob_name", "op": "eq", "value": None}],
+        [{"field": "blob_name", "op": "in", "value": []}],
+        [{"field": "blob_name", "op": "in", "value": ["a.pdf", None]}],
+        [{"field": "blob_name", "op": "prefix"}],
+    ],
+)
+def test_invalid_filters(filters):
+    with pytest.raises(FilterError):
+        build(filters)
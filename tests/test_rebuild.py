@@ -0,0 +1,102 @@
+"""
+重建索引期间旧索引的隔离测试，需要一个带 RediSearch 模块的 Redis（如 redis-stack），连接串由 REDIS_URL 指定，例如
+
+    REDIS_URL=redis://localhost:6379 python -m pytest tests/test_rebuild.py
+"""
+import asyncio
+import os
+import uuid
+
+import pytest
+
+pytest.importorskip("redis")
+pytest.importorskip("langchain_community")
+pytest.importorskip("openai")
+
+if not os.environ.get("REDIS_URL"):
+    pytest.skip("REDIS_URL is not set", allow_module_level=True)
+
+import redis  # noqa: E402
+from redis.commands.search.field import TextField, VectorField  # noqa: E402
+from redis.commands.search.indexDefinition import IndexDefinition, IndexType  # noqa: E402
+from redis.commands.search.query import Query  # noqa: E402
+
+from common.indexconfig import IndexConfig, index_key_prefix, versioned_index_name  # noqa: E402
+from common.ingest import IngestPipeline  # noqa: E402
+
+VECTOR_SCHEMA = {"algorithm": "HNSW", "distance_metric": "cosine"}
+
+
+class FakeEmbeddings:
+    """按文本长度生成确定的三维向量，不请求嵌入服务。"""
+
+    def embed_documents(self, texts):
+        return [[1.0, float(len(t) % 7), 0.5] for t in texts]
+
+
+@pytest.fixture
+def client():
+    client = redis.Redis.from_url(os.environ["REDIS_URL"])
+    created = []
+    yield client, created
+    for name in created:
+        try:
+            client.ft(name).dropindex(delete_documents=True)
+        except redis.ResponseError:
+            pass
+        for prefix in (index_key_prefix(name), f"ragfp:{name}", f"ragver:{name}", f"ragmeta:{name}"):
+            keys = list(client.scan_iter(match=f"{prefix}*"))
+            if keys:
+                client.unlink(*keys)
+
+
+def ingest(client, name: str, texts):
+    pipeline = IngestPipeline(
+        name,
+        FakeEmbeddings(),
+        redis_url=os.environ["REDIS_URL"],
+        embedding_model="fake",
+        client=client,
+        vector_schema=VECTOR_SCHEMA,
+        index_config=IndexConfig(),
+    )
+    asyncio.run(pipeline.run_texts(texts, [{"blob_name": "a.txt"}] * len(texts)))
+
+
+def search_ids(client, name: str) -> set:
+    results = client.ft(name).search(Query("*").paging(0, 100).dialect(2))
+    return {doc.id.decode() if isinstance(doc.id, bytes) else doc.id for doc in results.docs}
+
+
+def test_legacy_index_does_not_see_rebuild_documents(client):
+    client, created = client
+    old = f"test_{uuid.uuid4().hex[:8]}"
+    created.append(old)
+    # 旧版本按 langchain 的方式注册了不带结尾冒号的前缀
+    client.ft(old).create_index(
+        [
+            TextField("content"),
+            VectorField("content_vector", "HNSW", {"TYPE": "FLOAT32", "DIM": 3, "DISTANCE_METRIC": "COSINE"}),
+        ],
+        definition=IndexDefinition(prefix=[f"doc:{old}"], index_type=IndexType.HASH),
+    )
+    client.hset(f"doc:{old}:a", mapping={"content": "old chunk", "content_vector": b"\0" * 12})
+
+    new = versioned_index_name(old)
+    created.append(new)
+    ingest(client, new, ["new chunk one", "new chunk two"])
+
+    # 重建写入期间，旧索引只返回自己的文档
+    assert search_ids(client, old) == {f"doc:{old}:a"}
+    assert len(search_ids(client, new)) == 2
+
+
+def test_index_prefix_does_not_cover_longer_names(client):
+    client, created = client
+    name = f"test_{uuid.uuid4().hex[:8]}"
+    created.extend([name, f"{name}2"])
+    ingest(client, name, ["first index chunk"])
+    ingest(client, f"{name}2", ["second index chunk", "another chunk"])
+
+    assert len(search_ids(client, name)) == 1
+    assert len(search_ids(client, f"{name}2")) == 2